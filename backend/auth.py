@@ -1,12 +1,19 @@
+import hashlib
+import hmac
+import os
+import secrets
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
 import database
+from cache import TTLCache
+from executor import password_executor
 
 # 配置密钥和算法
 SECRET_KEY = "your-secret-key-here"
@@ -18,12 +25,95 @@ REFRESH_TOKEN_EXPIRE_DAYS = 7
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="user/login")
 
+class UserSnapshot:
+    """认证后的用户信息，只包含接口需要的字段，不依赖数据库会话"""
+
+    def __init__(self, user: models.User):
+        self.id = user.id
+        self.username = user.username
+        self.created_at = user.created_at
+
+class PrincipalCache:
+    """token 中的用户名到用户快照的缓存
+
+    每个已认证的请求都要把 token 解析为用户，缓存命中时不再查询数据库；
+    用户信息修改时由 crud.update_user 失效，其他进程最长 ttl 秒后一致。
+    """
+
+    def __init__(self, ttl: float = 60, max_entries: int = 10000):
+        self._entries = TTLCache(ttl, max_entries)
+
+    def get(self, username: str) -> Optional[UserSnapshot]:
+        return self._entries.get(username)
+
+    def put(self, user: models.User) -> UserSnapshot:
+        snapshot = UserSnapshot(user)
+        self._entries.put(snapshot.username, snapshot)
+        return snapshot
+
+    def invalidate(self, *usernames: str):
+        for username in usernames:
+            self._entries.pop(username)
+
+principal_cache = PrincipalCache(
+    ttl=float(os.getenv("AUTH_CACHE_TTL", "60")),
+    max_entries=int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+)
+
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[models.User]:
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def resolve_user(db: AsyncSession, username: str) -> Optional[UserSnapshot]:
+    """按 token 中的用户名获取用户，优先使用缓存"""
+    user = principal_cache.get(username)
+    if user is None:
+        db_user = await get_user_by_username(db, username)
+        if db_user is None:
+            return None
+        user = principal_cache.put(db_user)
+    return user
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+class FailedLoginCache:
+    """最近验证失败的 (用户名, 密码) 记录
+
+    重复提交同一组错误凭据时直接拒绝，不再运行 bcrypt。只保存带进程内随机密钥的
+    HMAC，不保存密码；键中包含当前密码哈希，修改密码后旧记录自动失效。
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 10000):
+        self._key = secrets.token_bytes(32)
+        self._entries = TTLCache(ttl, max_entries)
+
+    def _digest(self, username: str, password: str, hashed_password: str) -> bytes:
+        message = "\0".join((username, password, hashed_password)).encode()
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def contains(self, username: str, password: str, hashed_password: str) -> bool:
+        return self._entries.get(self._digest(username, password, hashed_password), False)
+
+    def add(self, username: str, password: str, hashed_password: str):
+        self._entries.put(self._digest(username, password, hashed_password), True)
+
+failed_login_cache = FailedLoginCache(
+    ttl=float(os.getenv("FAILED_LOGIN_CACHE_TTL", "300")),
+    max_entries=int(os.getenv("FAILED_LOGIN_CACHE_SIZE", "10000"))
+)
+
+# bcrypt 每次耗时上百毫秒，请求处理中只能通过下面两个函数在独立线程池中运行，
+# 线程池繁忙时抛出 ExecutorBusyError
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_executor.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await password_executor.run(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -53,7 +143,7 @@ def verify_refresh_token(refresh_token: str) -> Optional[str]:
 
 async def get_current_user(
     authorization: str = Header(None),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -77,15 +167,30 @@ async def get_current_user(
     except (JWTError, ValueError):
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = await resolve_user(db, username)
     if user is None:
         raise credentials_exception
     return user
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(models.User).filter(models.User.username == username).first()
+async def get_optional_user(
+    authorization: str = Header(None),
+    db: AsyncSession = Depends(database.get_db)
+):
+    """与 get_current_user 相同，但未登录或凭据无效时返回 None"""
+    if not authorization:
+        return None
+    try:
+        return await get_current_user(authorization, db)
+    except HTTPException:
+        return None
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if failed_login_cache.contains(username, password, user.hashed_password):
+        return False
+    if not await verify_password_async(password, user.hashed_password):
+        failed_login_cache.add(username, password, user.hashed_password)
         return False
     return user 
\ No newline at end of file
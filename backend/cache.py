@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """进程内的过期 + LRU 缓存
+
+    条目在 ttl 秒后过期（ttl 为 None 时不过期，put 时也可以为单个条目指定），
+    超过 max_entries 时淘汰最久未使用的条目。多进程部署时各进程分别缓存。
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """保存条目；ttl 不传时使用默认值，小于等于0时不保存"""
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is not None and ttl <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
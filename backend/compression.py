@@ -1,5 +1,6 @@
 import heapq
-from collections import defaultdict
+import io
+from collections import Counter, defaultdict, deque
 import struct
 import time
 import os
@@ -10,6 +11,7 @@ import tempfile
 import shutil
 import asyncio
 import subprocess
+from concurrent.futures import Executor
 from typing import Callable
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
@@ -28,16 +30,251 @@ class AESCrypto:
         cipher = AES.new(self.key, AES.MODE_CBC, self.iv)
         return unpad(cipher.decrypt(data), AES.block_size)
 
+    def encryptor(self):
+        return _CBCStreamEncryptor(AES.new(self.key, AES.MODE_CBC, self.iv))
+
+    def decryptor(self):
+        return _CBCStreamDecryptor(AES.new(self.key, AES.MODE_CBC, self.iv))
+
+    def stream_stage(self):
+        return AESCTRStage(self.key)
+
+
+class _CBCStreamEncryptor:
+    """分块CBC加密，输出与对整个数据调用 AESCrypto.encrypt 相同"""
+
+    def __init__(self, cipher):
+        self._cipher = cipher
+        self._buffer = b''
+
+    def update(self, data):
+        data = self._buffer + data
+        usable = len(data) - len(data) % AES.block_size
+        self._buffer = data[usable:]
+        return self._cipher.encrypt(data[:usable])
+
+    def finalize(self):
+        return self._cipher.encrypt(pad(self._buffer, AES.block_size))
+
+
+class _CBCStreamDecryptor:
+    """分块CBC解密，最后一个分组保留到 finalize 时去除填充"""
+
+    def __init__(self, cipher):
+        self._cipher = cipher
+        self._buffer = b''
+
+    def update(self, data):
+        data = self._buffer + data
+        usable = len(data) - len(data) % AES.block_size
+        if usable == len(data):
+            usable -= AES.block_size
+        usable = max(0, usable)
+        self._buffer = data[usable:]
+        return self._cipher.decrypt(data[:usable])
+
+    def finalize(self):
+        return unpad(self._cipher.decrypt(self._buffer), AES.block_size)
+
+
+class StreamStage:
+    """压缩之后的流处理阶段（如加密）
+
+    wrap_writer 返回写入时处理数据的输出流；wrap_reader 检查文件头，数据由本阶段
+    写出时返回还原数据的输入流，否则把读取位置恢复原样并返回 None。
+    """
+
+    def wrap_writer(self, writer):
+        raise NotImplementedError
+
+    def wrap_reader(self, reader):
+        raise NotImplementedError
+
+
+class AESCTRStage(StreamStage):
+    """AES-CTR 流加密阶段
+
+    文件头为 魔数(3) 版本(1) nonce(8)，之后是密文。每个文件使用随机nonce，
+    计数器按16字节分组从0递增；CTR不需要填充，可以从任意位置开始解密，
+    因此解密后的输入流支持 seek（zip需要先读取文件末尾的目录）。
+    """
+    MAGIC = b'FCE'
+    VERSION = 1
+    HEADER = struct.Struct('>3sB8s')
+
+    def __init__(self, key):
+        self.key = key
+
+    def cipher_at(self, nonce, position):
+        cipher = AES.new(self.key, AES.MODE_CTR, nonce=nonce,
+                         initial_value=position // AES.block_size)
+        skip = position % AES.block_size
+        if skip:
+            cipher.encrypt(bytes(skip))
+        return cipher
+
+    def wrap_writer(self, writer):
+        nonce = os.urandom(8)
+        writer.write(self.HEADER.pack(self.MAGIC, self.VERSION, nonce))
+        return _CTRWriter(writer, self.cipher_at(nonce, 0))
+
+    def wrap_reader(self, reader):
+        start = reader.tell()
+        header = reader.read(self.HEADER.size)
+        if len(header) < self.HEADER.size or header[:3] != self.MAGIC:
+            reader.seek(start)
+            return None
+        _, version, nonce = self.HEADER.unpack(header)
+        if version != self.VERSION:
+            raise ValueError(f"不支持的加密格式版本: {version}")
+        return _CTRReader(reader, self, nonce, start + self.HEADER.size)
+
+
+class _CTRWriter:
+    def __init__(self, writer, cipher):
+        self._writer = writer
+        self._cipher = cipher
+
+    def write(self, data):
+        return self._writer.write(self._cipher.encrypt(data))
+
+    def flush(self):
+        self._writer.flush()
+
+
+class _CTRReader:
+    """边读边解密的输入流，seek 后从新位置重新生成密钥流"""
+
+    def __init__(self, reader, stage, nonce, data_start):
+        self._reader = reader
+        self._stage = stage
+        self._nonce = nonce
+        self._data_start = data_start
+        self._pos = 0
+        self._cipher = stage.cipher_at(nonce, 0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._reader.seek(0, 2) - self._data_start
+        self._pos = max(0, offset)
+        self._reader.seek(self._data_start + self._pos)
+        self._cipher = self._stage.cipher_at(self._nonce, self._pos)
+        return self._pos
+
+    def read(self, size=-1):
+        data = self._reader.read(size)
+        self._pos += len(data)
+        # CTR加解密是同一运算；定位时已用 encrypt 跳过了分组内的偏移
+        return self._cipher.encrypt(data)
+
+
+class _CountingWriter:
+    """记录已写入字节数的输出流包装"""
+
+    def __init__(self, writer):
+        self._writer = writer
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self._writer.write(data)
+
+    def flush(self):
+        self._writer.flush()
+
+
+# 分块容器格式：
+#   文件头  魔数(3) 版本(1) 算法(1) 标志(1) 块大小(4)
+#   数据块  原始长度(4) 压缩后长度(4) 压缩数据，原始长度为0的块表示结束
+#   块索引  每块 偏移(8) 原始长度(4) 压缩后长度(4)，最后是 块数(4) 索引偏移(8) 魔数(4)
+# 版本1没有块索引。容器写出后整体经过 AESCTRStage 加密。
+CONTAINER_MAGIC = b'FCB'
+CONTAINER_VERSION = 2
+CONTAINER_HEADER = struct.Struct('>3sBBBI')
+BLOCK_HEADER = struct.Struct('>II')
+INDEX_ENTRY = struct.Struct('>QII')
+INDEX_TRAILER = struct.Struct('>IQ4s')
+INDEX_MAGIC = b'FCBI'
+# 标志位：数据在压缩前已整体做过CBC加密（旧文件）
+FLAG_PRE_ENCRYPTED = 0x01
+ALGORITHM_IDS = {'lz77': 1, 'huffman': 2, 'combined': 3}
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# 解压时允许的最大块大小；块按原始长度预先分配内存，文件头中的块大小不能超过它
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _read_exact(reader, size):
+    data = reader.read(size)
+    if len(data) != size:
+        raise ValueError("压缩文件不完整")
+    return data
+
 
 class BaseCompressor:
+    ALGORITHM = None
+
     def __init__(self):
         self._progress_callback = None
         self._start_time = None
+        self._executor = None
+        self._thread_executor = None
         self.crypto = AESCrypto()
+        # 压缩之后依次经过的处理阶段，解压时逆序还原
+        self.stages = [self.crypto.stream_stage()]
+
+    def __getstate__(self):
+        # 数据块在进程池中处理时只需要编解码参数，进度回调和执行器无法序列化
+        state = self.__dict__.copy()
+        state['_progress_callback'] = None
+        state['_executor'] = None
+        state['_thread_executor'] = None
+        return state
 
     def set_progress_callback(self, callback: Callable):
         self._progress_callback = callback
 
+    def set_executor(self, executor: Executor, thread_executor: Executor = None):
+        """设置处理数据块的执行器（如进程池）和读写、加解密用的线程池
+
+        未设置时在事件循环所在线程中直接处理。
+        """
+        self._executor = executor
+        self._thread_executor = thread_executor
+
+    async def _run_in_thread(self, func, *args):
+        if self._thread_executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._thread_executor, func, *args)
+
+    def _max_pending_blocks(self):
+        # 同时在执行器中处理的块数，限制内存占用
+        if self._executor is None:
+            return 1
+        return 2 * getattr(self._executor, '_max_workers', os.cpu_count() or 1)
+
+    def _submit_block(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if self._executor is not None:
+            return loop.run_in_executor(self._executor, func, *args)
+        future = loop.create_future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
     async def _report_progress(self, progress: float, current_size: int, original_size: int):
         if self._progress_callback:
             elapsed_time = time.time() - self._start_time
@@ -67,136 +304,666 @@ class BaseCompressor:
                 }
             })
 
+    def compress_block(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress_block(self, payload: bytes, raw_size: int = None) -> bytes:
+        """解码一个数据块；raw_size 为块头中记录的原始长度，旧格式文件没有时为 None"""
+        raise NotImplementedError
+
+    def cache_params(self) -> str:
+        """影响压缩输出的参数，作为压缩结果缓存键的一部分"""
+        stages = '+'.join(type(stage).__name__ for stage in self.stages)
+        return f"fcb{CONTAINER_VERSION}:{self.block_params()}:{stages}"
+
+    def block_params(self) -> str:
+        return self.ALGORITHM
+
+    def wrap_writer(self, writer):
+        for stage in reversed(self.stages):
+            writer = stage.wrap_writer(writer)
+        return writer
+
+    def wrap_reader(self, reader):
+        """按各阶段还原输入流；文件不是由这些阶段写出的（旧格式）时返回 None"""
+        for stage in reversed(self.stages):
+            reader = stage.wrap_reader(reader)
+            if reader is None:
+                return None
+        return reader
+
+    async def compress(self, input_path: str, output_path: str):
+        original_size = os.path.getsize(input_path)
+        with open(input_path, 'rb') as reader, open(output_path, 'wb') as file:
+            await self.compress_stream(reader, self.wrap_writer(file), original_size=original_size)
+
+    async def decompress(self, input_path: str, output_path: str):
+        with open(input_path, 'rb') as file:
+            reader = self.wrap_reader(file)
+            if reader is None:
+                # 旧文件没有加密封装：压缩前加密的分块容器，或整体格式
+                is_legacy = file.read(len(CONTAINER_MAGIC)) != CONTAINER_MAGIC
+                file.seek(0)
+                reader = file
+            else:
+                is_legacy = False
+            if not is_legacy:
+                with open(output_path, 'wb') as writer:
+                    await self.decompress_stream(reader, writer)
+        if is_legacy:
+            await self._decompress_legacy(input_path, output_path)
+
+    async def _decompress_legacy(self, input_path: str, output_path: str):
+        raise ValueError("无法识别的压缩文件格式")
+
+    async def compress_stream(self, reader, writer, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                              original_size: int = None):
+        """按固定大小分块读取 reader，逐块压缩并写入 writer
+
+        设置了执行器时多个数据块并行压缩，按原顺序写出；内存占用只与
+        chunk_size 和并行块数有关。进度按已读取的原始字节数计算。
+        加密等处理由 wrap_writer 在压缩之后进行。
+        """
+        self._start_time = time.time()
+        writer = _CountingWriter(writer)
+        writer.write(CONTAINER_HEADER.pack(
+            CONTAINER_MAGIC, CONTAINER_VERSION, ALGORITHM_IDS[self.ALGORITHM], 0, chunk_size
+        ))
+
+        max_pending = self._max_pending_blocks()
+        pending = deque()
+        index = []
+        bytes_read = 0
+
+        async def write_oldest():
+            raw_size, consumed, future = pending.popleft()
+            payload = await future
+            index.append((writer.bytes_written, raw_size, len(payload)))
+            await self._run_in_thread(writer.write, BLOCK_HEADER.pack(raw_size, len(payload)) + payload)
+
+            total = original_size or bytes_read
+            await self._report_progress(min(1.0, consumed / total) if total else 1.0,
+                                        writer.bytes_written, total)
+
+        def read_chunk():
+            return reader.read(chunk_size)
+
+        try:
+            while True:
+                block = await self._run_in_thread(read_chunk)
+                if not block:
+                    break
+                bytes_read += len(block)
+
+                pending.append((len(block), bytes_read, self._submit_block(self.compress_block, block)))
+                if len(pending) >= max_pending:
+                    await write_oldest()
+
+            while pending:
+                await write_oldest()
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+
+        writer.write(BLOCK_HEADER.pack(0, 0))
+        index_offset = writer.bytes_written
+        for entry in index:
+            writer.write(INDEX_ENTRY.pack(*entry))
+        writer.write(INDEX_TRAILER.pack(len(index), index_offset, INDEX_MAGIC))
+        writer.flush()
+        await self._report_completion(writer.bytes_written, bytes_read)
+
+    async def decompress_stream(self, reader, writer):
+        magic, version, algorithm_id, flags, chunk_size = CONTAINER_HEADER.unpack(
+            _read_exact(reader, CONTAINER_HEADER.size))
+        if magic != CONTAINER_MAGIC or version not in (1, CONTAINER_VERSION):
+            raise ValueError("不支持的压缩文件格式")
+        if algorithm_id != ALGORITHM_IDS[self.ALGORITHM]:
+            raise ValueError("压缩文件与所选算法不匹配")
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError("压缩数据损坏：块大小无效")
+
+        decryptor = self.crypto.decryptor() if flags & FLAG_PRE_ENCRYPTED else None
+        max_pending = self._max_pending_blocks()
+        pending = deque()
+        index = []
+        offset = CONTAINER_HEADER.size
+
+        def write_block(block):
+            writer.write(decryptor.update(block) if decryptor else block)
+
+        async def write_oldest():
+            raw_size, future = pending.popleft()
+            block = await future
+            if len(block) != raw_size:
+                raise ValueError("压缩数据损坏：数据块长度不符")
+            await self._run_in_thread(write_block, block)
+
+        def read_frame():
+            raw_size, payload_size = BLOCK_HEADER.unpack(_read_exact(reader, BLOCK_HEADER.size))
+            if raw_size == 0 and payload_size == 0:
+                return raw_size, payload_size, None
+            # 在分配内存和提交解码之前检查块头中的长度
+            if raw_size > chunk_size:
+                raise ValueError("压缩数据损坏：数据块超过块大小")
+            return raw_size, payload_size, _read_exact(reader, payload_size)
+
+        try:
+            while True:
+                raw_size, payload_size, payload = await self._run_in_thread(read_frame)
+                if payload is None:
+                    break
+                index.append((offset, raw_size, payload_size))
+                offset += BLOCK_HEADER.size + payload_size
+
+                pending.append((raw_size, self._submit_block(self.decompress_block, payload, raw_size)))
+                if len(pending) >= max_pending:
+                    await write_oldest()
+                await asyncio.sleep(0)
+
+            while pending:
+                await write_oldest()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+        if version >= 2:
+            # 用块索引核对读到的数据块，确认文件完整
+            stored = await self._run_in_thread(
+                _read_exact, reader, INDEX_ENTRY.size * len(index) + INDEX_TRAILER.size)
+            count, index_offset, index_magic = INDEX_TRAILER.unpack(stored[-INDEX_TRAILER.size:])
+            entries = [INDEX_ENTRY.unpack_from(stored, i * INDEX_ENTRY.size) for i in range(count)] \
+                if count == len(index) else None
+            if index_magic != INDEX_MAGIC or index_offset != offset + BLOCK_HEADER.size or entries != index:
+                raise ValueError("压缩数据损坏：块索引不符")
+
+        if decryptor:
+            await self._run_in_thread(writer.write, decryptor.finalize())
+        writer.flush()
+
+    async def _decompress_legacy_file(self, input_path: str, output_path: str):
+        # 旧格式：整个文件是一个压缩数据段，解码后整体解密
+        with open(input_path, 'rb') as file:
+            data = await self._run_in_thread(file.read)
+
+        decompressed_data = await self._submit_block(self.decompress_block, data)
+        decrypted_data = await self._run_in_thread(self.crypto.decrypt, decompressed_data)
+
+        with open(output_path, 'wb') as file:
+            await self._run_in_thread(file.write, decrypted_data)
+
+class HashChainMatchFinder:
+    """LZ77 匹配查找器：基于哈希链（head/prev 表）
+
+    head 记录每个3字节键最近出现的位置，prev 是按窗口大小取模的环形链表，
+    沿链最多检查 max_chain 个候选位置。匹配长度至少为3（哈希键的长度）。
+    """
+
+    def __init__(self, window_size=4096, max_length=128, min_length=3, max_chain=32,
+                 lazy=True, nice_length=None):
+        self.window_size = window_size
+        self.max_length = max_length
+        self.min_length = max(3, min_length)
+        self.max_chain = max_chain
+        self.lazy = lazy
+        self.nice_length = min(nice_length or max_length, max_length)
+        self._ring_mask = (1 << (window_size - 1).bit_length()) - 1
+        self.reset(b'')
+
+    def reset(self, data):
+        self.data = bytes(data)
+        self.pos = 0
+        self._inserted = 0
+        self._head = {}
+        self._prev = [-1] * (self._ring_mask + 1)
+
+    def _insert(self, start, end):
+        # 将 [start, end) 内的位置加入哈希表
+        data = self.data
+        n = len(data)
+        head = self._head
+        prev = self._prev
+        mask = self._ring_mask
+        for p in range(start, min(end, n - 2)):
+            key = (data[p] << 16) | (data[p + 1] << 8) | data[p + 2]
+            prev[p & mask] = head.get(key, -1)
+            head[key] = p
+        if end > self._inserted:
+            self._inserted = end
+
+    def longest_match(self, pos):
+        """返回 pos 处的最长匹配 (length, offset)，无匹配时返回 (0, 0)"""
+        data = self.data
+        n = len(data)
+        limit = min(self.max_length, n - pos)
+        if limit < self.min_length:
+            return 0, 0
+
+        lowest = max(0, pos - self.window_size)
+        best_len = 0
+        best_off = 0
+
+        key = (data[pos] << 16) | (data[pos + 1] << 8) | data[pos + 2]
+        cand = self._head.get(key, -1)
+        prev = self._prev
+        mask = self._ring_mask
+        nice = min(self.nice_length, limit)
+        chain = self.max_chain
+        while cand >= lowest and chain > 0:
+            # 先比较当前最优长度处的字节，快速排除较短的候选
+            if best_len < 3 or data[cand + best_len] == data[pos + best_len]:
+                length = 3
+                while length + 8 <= limit and \
+                        data[cand + length:cand + length + 8] == data[pos + length:pos + length + 8]:
+                    length += 8
+                while length < limit and data[cand + length] == data[pos + length]:
+                    length += 1
+                if length > best_len:
+                    best_len = length
+                    best_off = pos - cand
+                    if length >= nice:
+                        break
+            cand = prev[cand & mask]
+            chain -= 1
+
+        if best_len < self.min_length:
+            return 0, 0
+        return best_len, best_off
+
+    def scan(self, end):
+        """从当前位置扫描到 end，返回匹配列表 [(pos, offset, length), ...]
+
+        最后一个匹配可能越过 end，扫描结束后 self.pos 指向下一个待处理位置。
+        """
+        data = self.data
+        n = len(data)
+        end = min(end, n)
+        lazy = self.lazy
+        nice = self.nice_length
+        longest_match = self.longest_match
+        insert = self._insert
+
+        matches = []
+        pos = self.pos
+        carried = None
+        while pos < end:
+            if self._inserted < pos:
+                insert(self._inserted, pos)
+            if carried is not None:
+                length, offset = carried
+                carried = None
+            else:
+                length, offset = longest_match(pos)
+            insert(pos, pos + 1)
+
+            if length == 0:
+                pos += 1
+                continue
+
+            # 惰性匹配：下一位置的匹配更长时，当前位置输出字面字节
+            if lazy and length < nice and pos + length < n:
+                next_length, next_offset = longest_match(pos + 1)
+                if next_length > length:
+                    carried = (next_length, next_offset)
+                    pos += 1
+                    continue
+
+            matches.append((pos, offset, length))
+            next_pos = min(n, pos + length)
+            insert(pos + 1, next_pos)
+            pos = next_pos
+
+        self.pos = pos
+        return matches
+
+
+LZ77_TOKEN = struct.Struct('>HBB')
+
+
+def _write_varint(out, value):
+    # 无符号LEB128：每字节7位，最高位表示后面还有字节
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _copy_match(view, pos, offset, length):
+    """把 pos-offset 处的 length 字节复制到 pos
+
+    源和目标不重叠时一次切片复制；重叠（offset < length）时输出以 offset 为周期
+    重复，把已有的一个周期成倍复制后一次写入。
+    """
+    start = pos - offset
+    if start < 0 or offset == 0:
+        raise ValueError("压缩数据损坏：LZ77偏移越界")
+    end = pos + length
+    if offset >= length:
+        view[pos:end] = view[start:start + length]
+    else:
+        period = view[start:pos].tobytes()
+        view[pos:end] = (period * (length // offset + 1))[:length]
+
+
 class LZ77Compressor(BaseCompressor):
-    def __init__(self, window_size=4096, look_ahead_size=128):
+    """LZ77 压缩
+
+    数据块格式（版本2）：魔数、版本、原始长度，之后是一串序列。每个序列以一个
+    标记字节开头，高4位为字面字节数，低4位为匹配长度减 MIN_MATCH，取值15时
+    用变长整数（LEB128）补充剩余部分；随后是字面字节和变长整数表示的偏移。
+    最后一个序列只有字面字节。旧版本每个令牌固定4字节，仍可解压。
+    """
+    ALGORITHM = 'lz77'
+    MAGIC = b'LZ7'
+    FORMAT_VERSION = 2
+    MIN_MATCH = 4
+
+    def __init__(self, window_size=4096, look_ahead_size=128, max_chain=32, lazy_matching=True):
         super().__init__()
         self.window_size = window_size
         self.look_ahead_size = look_ahead_size
+        self.max_chain = max_chain
+        self.lazy_matching = lazy_matching
 
-    async def compress(self, input_path: str, output_path: str):
-        self._start_time = time.time()
-        original_size = os.path.getsize(input_path)
+    def block_params(self) -> str:
+        return (f"lz77v{self.FORMAT_VERSION}/{self.window_size}/{self.look_ahead_size}/"
+                f"{self.max_chain}/{int(self.lazy_matching)}")
 
-        with open(input_path, 'rb') as file:
-            data = file.read()
-            
-        # 加密数据
-        encrypted_data = self.crypto.encrypt(data)
-        data = encrypted_data
+    def _make_match_finder(self):
+        return HashChainMatchFinder(
+            window_size=self.window_size,
+            max_length=self.look_ahead_size,
+            min_length=self.MIN_MATCH,
+            max_chain=self.max_chain,
+            lazy=self.lazy_matching
+        )
 
-        compressed_data = []
-        current_pos = 0
+    def compress_block(self, data: bytes) -> bytes:
+        finder = self._make_match_finder()
+        finder.reset(data)
         total_positions = len(data)
+        min_match = self.MIN_MATCH
 
-        while current_pos < len(data):
-            # 查找最长匹配
-            match_length = 0
-            match_offset = 0
+        result = bytearray(self.MAGIC)
+        result.extend(struct.pack('>BQ', self.FORMAT_VERSION, total_positions))
+        last = 0
+        for pos, offset, length in finder.scan(total_positions):
+            literal_count = pos - last
+            extra_length = length - min_match
+            result.append((min(literal_count, 15) << 4) | min(extra_length, 15))
+            if literal_count >= 15:
+                _write_varint(result, literal_count - 15)
+            result.extend(data[last:pos])
+            if extra_length >= 15:
+                _write_varint(result, extra_length - 15)
+            _write_varint(result, offset)
+            last = pos + length
 
-            start = max(0, current_pos - self.window_size)
-            window = data[start:current_pos]
-            lookahead = data[current_pos:current_pos + self.look_ahead_size]
+        # 最后一个序列只有字面字节（可能为0个）
+        literal_count = total_positions - last
+        result.append(min(literal_count, 15) << 4)
+        if literal_count >= 15:
+            _write_varint(result, literal_count - 15)
+        result.extend(data[last:])
+        return bytes(result)
 
-            # 最大长度匹配
-            for l in range(len(lookahead), 0, -1):
-                match_string = data[current_pos:current_pos + l]
+    def decompress_block(self, payload: bytes, raw_size: int = None) -> bytes:
+        if payload[:3] != self.MAGIC:
+            return self._decode_legacy_tokens(payload, raw_size)
+        if len(payload) < 12:
+            raise ValueError("压缩数据损坏：LZ77数据块不完整")
+        version, stored_size = struct.unpack_from('>BQ', payload, 3)
+        if version != self.FORMAT_VERSION:
+            raise ValueError(f"不支持的LZ77格式版本: {version}")
+        if raw_size is not None and raw_size != stored_size:
+            raise ValueError("压缩数据损坏：LZ77数据块长度不符")
+        # 旧文件的整体解码不知道原始长度，按块长度上限检查，避免按伪造的长度分配内存
+        if stored_size > MAX_CHUNK_SIZE:
+            raise ValueError("压缩数据损坏：LZ77数据块过大")
 
-                try:
-                    of = window.rindex(match_string)
-                except ValueError:
-                    continue
+        data = payload
+        n = len(data)
+        i = 12
+        min_match = self.MIN_MATCH
+        out = bytearray(stored_size)
+        view = memoryview(out)
+        pos = 0
+        try:
+            while i < n:
+                token = data[i]
+                i += 1
 
-                match_length = l  # 实际length
-                match_offset = current_pos - start - of  # 实际offset
-                break
+                literal_count = token >> 4
+                if literal_count == 15:
+                    b = 0x80
+                    shift = 0
+                    while b & 0x80:
+                        b = data[i]
+                        i += 1
+                        literal_count += (b & 0x7F) << shift
+                        shift += 7
+                if literal_count:
+                    end = pos + literal_count
+                    if i + literal_count > n or end > stored_size:
+                        raise ValueError
+                    view[pos:end] = data[i:i + literal_count]
+                    i += literal_count
+                    pos = end
+                if i >= n:
+                    break
 
-            if match_length > 0:
-                if current_pos + match_length < len(data):
-                    compressed_data.append((match_offset, match_length, data[current_pos + match_length]))
+                length = (token & 0x0F) + min_match
+                if token & 0x0F == 15:
+                    b = 0x80
+                    shift = 0
+                    while b & 0x80:
+                        b = data[i]
+                        i += 1
+                        length += (b & 0x7F) << shift
+                        shift += 7
+                b = data[i]
+                i += 1
+                offset = b & 0x7F
+                shift = 7
+                while b & 0x80:
+                    b = data[i]
+                    i += 1
+                    offset |= (b & 0x7F) << shift
+                    shift += 7
+
+                start = pos - offset
+                if offset >= length and start >= 0:
+                    end = pos + length
+                    view[pos:end] = view[start:start + length]
+                    pos = end
                 else:
-                    compressed_data.append((match_offset, match_length))
-                current_pos += match_length + 1
-            else:
-                compressed_data.append((0, 0, data[current_pos]))
-                current_pos += 1
-
-            # 每处理1%的数据就更新一次进度
-            if current_pos % (total_positions // 100) == 0 or current_pos == total_positions:
-                progress = current_pos / total_positions
-                current_size = len(compressed_data) * 4  # 估算压缩后大小
-                await self._report_progress(progress, current_size, original_size)
-
-        # 将压缩数据写入文件
-        result = bytearray()
-        for item in compressed_data:
-            if len(item) == 3:
-                offset, length, next_char = item
-                result.extend(offset.to_bytes(2, 'big'))
-                result.append(length)
-                result.append(next_char)
-            else:
-                offset, length = item
-                result.append(0xFF)  # 特殊标记
-                result.extend(offset.to_bytes(2, 'big'))
-                result.append(length)
-        with open(output_path, 'wb') as file:
-            file.write(result)
+                    _copy_match(view, pos, offset, length)
+                    pos += length
+        except (IndexError, ValueError):
+            raise ValueError("压缩数据损坏：LZ77数据块长度不符")
+        finally:
+            view.release()
+        if pos != stored_size:
+            raise ValueError("压缩数据损坏：LZ77数据块长度不符")
+        return bytes(out)
 
-        # 报告完成
-        final_size = os.path.getsize(output_path)
-        await self._report_completion(final_size, original_size)
+    def _decode_legacy_tokens(self, payload, raw_size):
+        # 旧格式令牌为 (偏移2字节, 长度1字节, 字符)；最后一个匹配以 0xFF 开头，不带字符
+        if len(payload) % LZ77_TOKEN.size:
+            raise ValueError("压缩数据损坏：LZ77令牌不完整")
+        if raw_size is None:
+            # 旧格式文件没有记录原始长度，先扫描一遍令牌计算
+            raw_size = sum(length + 1 if offset < 0xFF00 else value
+                           for offset, length, value in LZ77_TOKEN.iter_unpack(payload))
 
-    async def decompress(self, input_path: str, output_path: str):
-        with open(input_path, 'rb') as file:
-            data = file.read()
+        # 0xFF 标记只出现在最后一个令牌，先取出，主循环不用再判断
+        final = None
+        if len(payload) >= 4 and payload[-4] == 0xFF:
+            final = int.from_bytes(payload[-3:-1], 'big'), payload[-1]
+            payload = memoryview(payload)[:-4]
 
-        decompressed_data = bytearray()
-        i = 0
-        while i < len(data):
-            if data[i] != 0xFF:
-                # print("No 0xFF")
-                offset = int.from_bytes(data[i:i + 2], "big")
-                length = data[i + 2]
-                # print(f"offset={offset}, length={length}, len={len(result)}")
-                # print(result)
-                # 复制匹配内容
-                if offset != 0 and length != 0:
-                    start = len(decompressed_data) - offset
-                    for j in range(length):
-                        decompressed_data.append(decompressed_data[start + j])
-                next_char = data[i + 3]
-                decompressed_data.append(next_char)
-                i += 4
+        out = bytearray(raw_size)
+        view = memoryview(out)
+        pos = 0
+        try:
+            for offset, length, value in LZ77_TOKEN.iter_unpack(payload):
+                if length and offset:
+                    start = pos - offset
+                    if offset >= length and start >= 0:
+                        end = pos + length
+                        view[pos:end] = view[start:start + length]
+                        pos = end
+                    else:
+                        _copy_match(view, pos, offset, length)
+                        pos += length
+                out[pos] = value
+                pos += 1
+            if final is not None:
+                _copy_match(view, pos, *final)
+                pos += final[1]
+        except (IndexError, ValueError):
+            raise ValueError("压缩数据损坏：LZ77数据块长度不符")
+        finally:
+            view.release()
+        if pos != raw_size:
+            raise ValueError("压缩数据损坏：LZ77数据块长度不符")
+        return bytes(out)
+
+    async def _decompress_legacy(self, input_path: str, output_path: str):
+        # 旧格式：整个文件是一串令牌
+        await self._decompress_legacy_file(input_path, output_path)
+
+
+class HuffmanDecodeTable:
+    """Huffman 多级查表解码器
+
+    主表按接下来的 primary_bits 位索引，码长不超过 primary_bits 的码字一次查表
+    即得到符号；更长的码字在主表中指向子表，子表同样按固定位宽继续索引。
+    表项为 (码长 << 8) | 符号，负数 -(k + 1) 表示第 k 个子表。
+    """
+
+    PRIMARY_BITS = 10
+
+    def __init__(self, codes, primary_bits=PRIMARY_BITS):
+        # codes: {符号: '0101' 形式的码字}
+        self.primary_bits = primary_bits
+        self.subtables = []
+        items = list(codes.items())
+        # 只有一个符号时旧编码器给出空码字，不占任何位
+        self.empty_code_symbol = items[0][0] if len(items) == 1 and items[0][1] == '' else None
+        max_length = max((len(code) for _, code in items), default=0)
+        self.root_bits = max(1, min(primary_bits, max_length))
+        self.root = self._build(items, self.root_bits)
+
+    def _build(self, items, bits):
+        table = [None] * (1 << bits)
+        long_codes = defaultdict(list)
+        for symbol, code in items:
+            if len(code) <= bits:
+                shift = bits - len(code)
+                base = int(code, 2) << shift if code else 0
+                entry = (len(code) << 8) | symbol
+                for index in range(base, base + (1 << shift)):
+                    table[index] = entry
             else:
-                # print("0xFF")
-                offset = int.from_bytes(data[i + 1:i + 3], "big")
-                length = data[i + 3]
-                # print(f"offset={offset}, length={length}, len={len(result)}")
-                # print(result)
-                # 复制匹配内容
-                start = len(decompressed_data) - offset
-                for j in range(length):
-                    decompressed_data.append(decompressed_data[start + j])
-                i += 4
-        
-        # 解密数据
-        decrypted_data = self.crypto.decrypt(bytes(decompressed_data))
-        decompressed_data = decrypted_data
+                long_codes[code[:bits]].append((symbol, code[bits:]))
 
-        with open(output_path, 'wb') as file:
-            file.write(decompressed_data)
+        for prefix, sub_items in long_codes.items():
+            sub_bits = min(self.primary_bits, max(len(code) for _, code in sub_items))
+            self.subtables.append(None)
+            index = len(self.subtables) - 1
+            self.subtables[index] = (self._build(sub_items, sub_bits), sub_bits)
+            table[int(prefix, 2)] = -(index + 1)
+        return table
+
+    def decode(self, data, total_bits=None, count=None):
+        """解码 data，直到消耗 total_bits 位或输出 count 个符号"""
+        if total_bits is None:
+            total_bits = len(data) * 8
+        if count is None:
+            count = -1
+        if self.empty_code_symbol is not None:
+            return bytearray([self.empty_code_symbol]) * max(count, 0)
+        root = self.root
+        root_bits = self.root_bits
+        root_mask = (1 << root_bits) - 1
+        subtables = self.subtables
+
+        out = bytearray()
+        acc = 0
+        nbits = 0
+        pos = 0
+        consumed = 0
+        try:
+            while consumed < total_bits and len(out) != count:
+                if nbits < 32:
+                    # 每次补充64位，越过数据末尾的部分补0
+                    chunk = data[pos:pos + 8]
+                    pos += 8
+                    if len(chunk) < 8:
+                        chunk = bytes(chunk).ljust(8, b'\0')
+                    acc = ((acc & ((1 << nbits) - 1)) << 64) | int.from_bytes(chunk, 'big')
+                    nbits += 64
+
+                entry = root[(acc >> (nbits - root_bits)) & root_mask]
+                if entry >= 0:
+                    length = entry >> 8
+                    nbits -= length
+                    consumed += length
+                    out.append(entry & 0xFF)
+                    continue
+
+                # 长码字：逐级查子表
+                nbits -= root_bits
+                consumed += root_bits
+                while True:
+                    table, bits = subtables[-entry - 1]
+                    if nbits < bits:
+                        chunk = data[pos:pos + 8]
+                        pos += 8
+                        if len(chunk) < 8:
+                            chunk = bytes(chunk).ljust(8, b'\0')
+                        acc = ((acc & ((1 << nbits) - 1)) << 64) | int.from_bytes(chunk, 'big')
+                        nbits += 64
+                    entry = table[(acc >> (nbits - bits)) & ((1 << bits) - 1)]
+                    if entry >= 0:
+                        length = entry >> 8
+                        nbits -= length
+                        consumed += length
+                        out.append(entry & 0xFF)
+                        break
+                    nbits -= bits
+                    consumed += bits
+        except TypeError:
+            raise ValueError("Huffman数据损坏：无效的码字")
+
+        if consumed > total_bits:
+            raise ValueError("Huffman数据损坏：码字越过数据末尾")
+        return out
 
 
 class HuffmanCompressor(BaseCompressor):
+    ALGORITHM = 'huffman'
+    # 每次编码的符号数，限制中间比特串的内存占用
+    ENCODE_CHUNK_SIZE = 64 * 1024
+    # 文件头：魔数 + 版本号；旧格式以4字节频率表长度开头，首字节总是0
+    MAGIC = b'HUF'
+    FORMAT_VERSION = 2
+    # 码长上限，保证码长表每项占4位、解码表大小有界
+    MAX_CODE_LENGTH = 15
+
     def __init__(self):
         super().__init__()
         self.frequency = defaultdict(int)
         self.huffman_codes = {}
         self.reverse_mapping = {}
 
+    def block_params(self) -> str:
+        return f"huffmanv{self.FORMAT_VERSION}/{self.MAX_CODE_LENGTH}"
+
     def make_frequency_dict(self, text):
-        for symbol in text:
-            self.frequency[symbol] += 1
+        for symbol, count in Counter(text).items():
+            self.frequency[symbol] += count
 
     def make_heap(self):
         heap = [[weight, [symbol, ""]] for symbol, weight in self.frequency.items()]
@@ -219,225 +986,268 @@ class HuffmanCompressor(BaseCompressor):
         self.huffman_codes = dict(current_code)
         self.reverse_mapping = {v: k for k, v in self.huffman_codes.items()}
 
-    async def compress(self, input_path: str, output_path: str):
-        self._start_time = time.time()
-        original_size = os.path.getsize(input_path)
+    def make_code_lengths(self):
+        """由频率表计算每个符号的码长，超过 MAX_CODE_LENGTH 时压缩频率后重算"""
+        lengths = [0] * 256
+        weights = {symbol: freq for symbol, freq in self.frequency.items() if freq > 0}
+        if len(weights) == 1:
+            lengths[next(iter(weights))] = 1
+            return lengths
 
-        with open(input_path, 'rb') as file:
-            text = file.read()
-            
-        # 加密数据
-        encrypted_text = self.crypto.encrypt(text)
-        text = encrypted_text
-
-        # 第一阶段：构建Huffman树（10%进度）
-        self.make_frequency_dict(text)
-        heap = self.make_heap()
-        self.merge_nodes(heap)
-        self.make_codes(heap)
-        await self._report_progress(0.1, 0, original_size)
-
-        # 第二阶段：编码数据（40%进度）
-        encoded_text = ""
-        total_symbols = len(text)
-        processed_symbols = 0
-
-        for symbol in text:
-            encoded_text += self.huffman_codes[symbol]
-            processed_symbols += 1
-
-            # 每处理1%的数据就更新一次进度
-            if processed_symbols % (total_symbols // 100) == 0:
-                progress = 0.1 + (processed_symbols / total_symbols * 0.4)  # 10%-50%的进度
-                current_size = len(encoded_text) // 8
-                await self._report_progress(progress, current_size, original_size)
-
-        # 填充编码后的文本
-        padding_length = 8 - (len(encoded_text) % 8)
-        encoded_text += '0' * padding_length
-
-        # 第三阶段：转换为字节并写入文件（50%进度）
-        b = bytearray()
-        total_bytes = len(encoded_text) // 8
-        processed_bytes = 0
-
-        # 保存频率表和填充长度
-        header = struct.pack('>I', len(self.frequency))
-        for symbol, freq in self.frequency.items():
-            header += struct.pack('>BI', symbol, freq)
-        header += struct.pack('>B', padding_length)
-        b.extend(header)
-
-        for i in range(0, len(encoded_text), 8):
-            byte = encoded_text[i:i + 8]
-            b.append(int(byte, 2))
-            processed_bytes += 1
-
-            if processed_bytes % (total_bytes // 50) == 0:
-                progress = 0.5 + (processed_bytes / total_bytes * 0.5)  # 50%-100%的进度
-                current_size = len(b)
-                await self._report_progress(progress, current_size, original_size)
-                await asyncio.sleep(0.01)
-
-        # 写入文件
-        with open(output_path, 'wb') as file:
-            file.write(bytes(b))
+        while True:
+            heap = [(weight, symbol, [symbol]) for symbol, weight in weights.items()]
+            heapq.heapify(heap)
+            depth = [0] * 256
+            order = 256
+            while len(heap) > 1:
+                w1, _, s1 = heapq.heappop(heap)
+                w2, _, s2 = heapq.heappop(heap)
+                for symbol in s1:
+                    depth[symbol] += 1
+                for symbol in s2:
+                    depth[symbol] += 1
+                heapq.heappush(heap, (w1 + w2, order, s1 + s2))
+                order += 1
+            if max(depth) <= self.MAX_CODE_LENGTH:
+                return depth
+            weights = {symbol: (weight + 1) >> 1 for symbol, weight in weights.items()}
 
-        # 报告完成
-        final_size = os.path.getsize(output_path)
-        await self._report_completion(final_size, original_size)
+    def make_canonical_codes(self, lengths):
+        """按 (码长, 符号) 顺序分配规范Huffman码"""
+        self.huffman_codes = {}
+        code = 0
+        prev_length = 0
+        for length, symbol in sorted((length, symbol) for symbol, length in enumerate(lengths) if length):
+            code <<= length - prev_length
+            self.huffman_codes[symbol] = format(code, f'0{length}b')
+            code += 1
+            prev_length = length
+        self.reverse_mapping = {v: k for k, v in self.huffman_codes.items()}
 
-    async def decompress(self, input_path: str, output_path: str):
-        with open(input_path, 'rb') as file:
-            # 读取频率表
-            freq_size = struct.unpack('>I', file.read(4))[0]
+    @staticmethod
+    def pack_code_lengths(lengths):
+        # 游程编码：每字节高4位为 游程-1，低4位为码长
+        packed = bytearray()
+        i = 0
+        while i < 256:
+            run = 1
+            while i + run < 256 and run < 16 and lengths[i + run] == lengths[i]:
+                run += 1
+            packed.append(((run - 1) << 4) | lengths[i])
+            i += run
+        return struct.pack('>H', len(packed)) + bytes(packed)
+
+    @staticmethod
+    def unpack_code_lengths(file):
+        packed_size = struct.unpack('>H', file.read(2))[0]
+        lengths = []
+        for value in file.read(packed_size):
+            lengths.extend([value & 0x0F] * ((value >> 4) + 1))
+        if len(lengths) != 256:
+            raise ValueError("Huffman码长表损坏")
+        return lengths
+
+    def make_code_table(self):
+        # 256项码表，按字节值直接索引
+        table = [''] * 256
+        for symbol, code in self.huffman_codes.items():
+            table[symbol] = code
+        return table
+
+    def compress_block(self, data: bytes) -> bytes:
+        # 第一阶段：计算码长并分配规范Huffman码
+        self.frequency = defaultdict(int)
+        self.make_frequency_dict(data)
+        lengths = self.make_code_lengths()
+        self.make_canonical_codes(lengths)
+
+        # 第二阶段：按码表分块编码，每块的比特串直接转换为字节
+        table = self.make_code_table()
+        total_symbols = len(data)
+        step = self.ENCODE_CHUNK_SIZE
+        encoded = bytearray()
+        pending_bits = ''
+
+        for i in range(0, total_symbols, step):
+            bits = pending_bits + ''.join(map(table.__getitem__, data[i:i + step]))
+            usable = len(bits) - len(bits) % 8
+            if usable:
+                encoded.extend(int(bits[:usable], 2).to_bytes(usable // 8, 'big'))
+            pending_bits = bits[usable:]
+
+        # 末尾不足一字节的部分补0，解码时按符号数截止
+        if pending_bits:
+            encoded.append(int(pending_bits.ljust(8, '0'), 2))
+
+        # 头部：魔数、版本、符号数、码长表
+        b = bytearray(self.MAGIC)
+        b.extend(struct.pack('>BQ', self.FORMAT_VERSION, total_symbols))
+        b.extend(self.pack_code_lengths(lengths))
+        b.extend(encoded)
+        return bytes(b)
+
+    def decompress_block(self, payload: bytes, raw_size: int = None, max_size: int = None) -> bytes:
+        """raw_size 为块的原始长度；不知道确切长度时用 max_size 限制输出大小，默认为块大小上限"""
+        file = io.BytesIO(payload)
+        head = file.read(4)
+        if head[:3] == self.MAGIC:
+            if head[3] != self.FORMAT_VERSION:
+                raise ValueError(f"不支持的Huffman格式版本: {head[3]}")
+            # 由码长表直接重建规范码，无需重建哈夫曼树
+            symbol_count = struct.unpack('>Q', file.read(8))[0]
+            if raw_size is not None and symbol_count != raw_size:
+                raise ValueError("压缩数据损坏：Huffman数据块长度不符")
+            if max_size is None:
+                max_size = MAX_CHUNK_SIZE
+            if symbol_count > max_size:
+                raise ValueError("压缩数据损坏：Huffman数据块过大")
+            self.make_canonical_codes(self.unpack_code_lengths(file))
+            total_bits = None
+        else:
+            # 旧格式：读取频率表并重建哈夫曼树
+            self.frequency = defaultdict(int)
+            freq_size = struct.unpack('>I', head)[0]
             for _ in range(freq_size):
                 symbol, freq = struct.unpack('>BI', file.read(5))
                 self.frequency[symbol] = freq
 
-            # 重建哈夫曼树
             heap = self.make_heap()
             self.merge_nodes(heap)
             self.make_codes(heap)
 
             # 读取填充长度
             padding_length = struct.unpack('>B', file.read(1))[0]
+            symbol_count = None
+            total_bits = (len(payload) - file.tell()) * 8 - padding_length
 
-            # 读取压缩数据
-            compressed_data = file.read()
-
-            # 将字节转换回二进制字符串
-            encoded_text = ""
-            for byte in compressed_data:
-                encoded_text += format(byte, '08b')
+        # 按码表查表解码
+        decoder = HuffmanDecodeTable(self.huffman_codes)
+        compressed_data = memoryview(payload)[file.tell():]
+        return bytes(decoder.decode(compressed_data, total_bits, symbol_count))
 
-            # 移除填充
-            encoded_text = encoded_text[:-padding_length]
-
-            # 解码
-            current_code = ""
-            decompressed_data = []
-            for bit in encoded_text:
-                current_code += bit
-                if current_code in self.reverse_mapping:
-                    decompressed_data.append(self.reverse_mapping[current_code])
-                    current_code = ""
-
-            # 解密数据
-            decrypted_data = self.crypto.decrypt(bytes(decompressed_data))
-            
-            # 保存解压后的数据
-            with open(output_path, 'wb') as file:
-                file.write(decrypted_data)
+    async def _decompress_legacy(self, input_path: str, output_path: str):
+        # 旧格式：整个文件是一个Huffman数据段
+        await self._decompress_legacy_file(input_path, output_path)
 
 
 class ZipCompressor(BaseCompressor):
+    def cache_params(self) -> str:
+        stages = '+'.join(type(stage).__name__ for stage in self.stages)
+        return f"zip:deflate:{stages}"
+
     async def compress(self, input_path: str, output_path: str):
-        self._start_time = time.time()
         original_size = os.path.getsize(input_path)
-        
+        with open(input_path, 'rb') as reader, open(output_path, 'wb') as file:
+            await self.compress_stream(reader, self.wrap_writer(file), original_size=original_size,
+                                       arcname=os.path.basename(input_path))
+
+    async def compress_stream(self, reader, writer, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                              original_size: int = None, arcname: str = 'data'):
+        self._start_time = time.time()
+        writer = _CountingWriter(writer)
+        # 未知大小或超过2GB时需要ZIP64
+        force_zip64 = original_size is None or original_size > 0x7FFFFFFF
+
+        def write_chunk(entry):
+            # 读取、deflate和加密都会释放GIL，整体放在线程池中执行
+            chunk = reader.read(chunk_size)
+            if chunk:
+                entry.write(chunk)
+            return len(chunk)
+
+        bytes_read = 0
         try:
-            with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-                # 获取输入文件的基本名称
-                base_name = os.path.basename(input_path)
-                
-                # 读取数据并加密
-                with open(input_path, 'rb') as f:
-                    data = f.read()
-                    encrypted_data = self.crypto.encrypt(data)
-                    total_size = len(data)
-                    
-                    # 将加密数据写入zip文件
-                    zf.writestr(base_name, encrypted_data)
-                    
-                    # 模拟进度更新
-                    for i in range(0, 101, 2):  # 每2%更新一次
-                        bytes_written = int((i / 100) * total_size)
-                        progress = i / 100
-                        await self._report_progress(progress, bytes_written, original_size)
-                
-                # 报告完成
-                await self._report_completion(total_size, original_size)
-                
+            with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as zf:
+                with zf.open(arcname, 'w', force_zip64=force_zip64) as entry:
+                    # 逐块读取并写入zip文件
+                    while True:
+                        size = await self._run_in_thread(write_chunk, entry)
+                        if not size:
+                            break
+                        bytes_read += size
+
+                        total = original_size or bytes_read
+                        await self._report_progress(min(1.0, bytes_read / total),
+                                                    writer.bytes_written, total)
         except Exception as e:
             print(f"压缩过程中出错: {str(e)}")
             raise
 
+        # 报告完成
+        await self._report_completion(writer.bytes_written, bytes_read)
+
     async def decompress(self, input_path: str, output_path: str):
-        # 临时提取文件
-        temp_dir = tempfile.mkdtemp()
-        try:
-            with zipfile.ZipFile(input_path, 'r') as zf:
-                zf.extractall(path=temp_dir)
-                
-                # 解密解压后的文件
-                extracted_file = os.path.join(temp_dir, os.path.basename(output_path))
-                with open(extracted_file, 'rb') as f:
-                    encrypted_data = f.read()
-                    
-                # 解密数据
-                decrypted_data = self.crypto.decrypt(encrypted_data)
-                
-                # 写入解密后的数据
-                with open(output_path, 'wb') as f:
-                    f.write(decrypted_data)
-        finally:
-            # 清理临时目录
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        with open(input_path, 'rb') as file, open(output_path, 'wb') as writer:
+            reader = self.wrap_reader(file)
+            if reader is None:
+                # 旧文件：没有加密封装，zip条目内是CBC密文
+                await self.decompress_stream(file, writer, pre_encrypted=True)
+            else:
+                await self.decompress_stream(reader, writer)
+
+    async def decompress_stream(self, reader, writer, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                pre_encrypted: bool = False):
+        decryptor = self.crypto.decryptor() if pre_encrypted else None
+        with zipfile.ZipFile(reader, 'r') as zf:
+            names = zf.namelist()
+            if not names:
+                raise ValueError("zip文件为空")
+            def write_chunk(entry):
+                chunk = entry.read(chunk_size)
+                if chunk:
+                    writer.write(decryptor.update(chunk) if decryptor else chunk)
+                return len(chunk)
+
+            # 逐块读取第一个条目
+            with zf.open(names[0], 'r') as entry:
+                while await self._run_in_thread(write_chunk, entry):
+                    await asyncio.sleep(0)
+        if decryptor:
+            await self._run_in_thread(writer.write, decryptor.finalize())
+        writer.flush()
+
+class CombinedCompressor(BaseCompressor):
+    ALGORITHM = 'combined'
 
-class CombinedCompressor:
     def __init__(self):
+        super().__init__()
         self.lz77_compressor = LZ77Compressor()
         self.huffman_compressor = HuffmanCompressor()
-        self.progress_callback = None
 
-    def set_progress_callback(self, callback):
-        self.progress_callback = callback
-        self.lz77_compressor.set_progress_callback(callback)
-        self.huffman_compressor.set_progress_callback(callback)
+    def set_executor(self, executor: Executor, thread_executor: Executor = None):
+        super().set_executor(executor, thread_executor)
+        self.lz77_compressor.set_executor(executor, thread_executor)
+        self.huffman_compressor.set_executor(executor, thread_executor)
+
+    def block_params(self) -> str:
+        return f"{self.lz77_compressor.block_params()}+{self.huffman_compressor.block_params()}"
+
+    def compress_block(self, data: bytes) -> bytes:
+        # LZ77令牌直接交给Huffman编码，不经过临时文件和二次加密
+        return self.huffman_compressor.compress_block(self.lz77_compressor.compress_block(data))
+
+    def decompress_block(self, payload: bytes, raw_size: int = None) -> bytes:
+        # 限制Huffman层的输出：旧格式LZ77令牌每个4字节、至少对应1个原始字节，
+        # 中间数据最多是原始数据的4倍
+        max_size = raw_size * LZ77_TOKEN.size + 64 if raw_size is not None else None
+        return self.lz77_compressor.decompress_block(
+            self.huffman_compressor.decompress_block(payload, max_size=max_size), raw_size)
+
+    def _decode_legacy(self, data: bytes) -> bytes:
+        # 旧格式是 Huffman(CBC(LZ77(CBC(原文))))，逐层在内存中还原
+        tokens = self.crypto.decrypt(self.huffman_compressor.decompress_block(data))
+        return self.crypto.decrypt(self.lz77_compressor.decompress_block(tokens))
+
+    async def _decompress_legacy(self, input_path, output_path):
+        # 不再经过临时文件：整个解码链在一次执行器调用中完成
+        with open(input_path, 'rb') as file:
+            data = await self._run_in_thread(file.read)
+
+        decompressed_data = await self._submit_block(self._decode_legacy, data)
+
+        with open(output_path, 'wb') as file:
+            await self._run_in_thread(file.write, decompressed_data)
 
-    async def compress(self, input_path, output_path):
-        # 创建临时文件路径
-        temp_path = f"{output_path}.temp"
-        
-        try:
-            # 第一步：LZ77压缩
-            await self.lz77_compressor.compress(input_path, temp_path)
-            
-            # 第二步：Huffman压缩
-            await self.huffman_compressor.compress(temp_path, output_path)
-            
-            # 删除临时文件
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-                
-        except Exception as e:
-            # 确保清理临时文件
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            raise e
-
-    async def decompress(self, input_path, output_path):
-        # 创建临时文件路径
-        temp_path = f"{output_path}.temp"
-        
-        try:
-            # 第一步：Huffman解压
-            await self.huffman_compressor.decompress(input_path, temp_path)
-            
-            # 第二步：LZ77解压
-            await self.lz77_compressor.decompress(temp_path, output_path)
-            
-            # 删除临时文件
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-                
-        except Exception as e:
-            # 确保清理临时文件
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            raise e 
-        
 class SevenZipCompressor:
     def __init__(self):
         self.progress_callback = None
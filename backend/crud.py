@@ -1,41 +1,54 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
 from datetime import datetime, timedelta
 import models
 import auth
+import shares
 from typing import Optional
 
 # 用户相关操作
-def create_user(db: Session, username: str, password: str):
-    hashed_password = auth.get_password_hash(password)
+async def create_user(db: AsyncSession, username: str, password: Optional[str] = None,
+                      hashed_password: Optional[str] = None):
+    # 只传入明文密码时也在密码哈希线程池中计算，不阻塞事件循环
+    if hashed_password is None:
+        hashed_password = await auth.get_password_hash_async(password)
     db_user = models.User(username=username, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
 
-def update_user(db: Session, user_id: int, username: Optional[str] = None, password: Optional[str] = None):
-    db_user = get_user(db, user_id)
+async def update_user(db: AsyncSession, user_id: int, username: Optional[str] = None, password: Optional[str] = None,
+                      hashed_password: Optional[str] = None):
+    db_user = await get_user(db, user_id)
     if not db_user:
         return None
+    old_username = db_user.username
     
     if username:
         db_user.username = username
-    if password:
-        db_user.hashed_password = auth.get_password_hash(password)
+    if hashed_password:
+        db_user.hashed_password = hashed_password
+    elif password:
+        db_user.hashed_password = await auth.get_password_hash_async(password)
     
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    # 旧用户名的 token 不再有效，新用户名重新从数据库加载
+    auth.principal_cache.invalidate(old_username, db_user.username)
     return db_user
 
 # 文件相关操作
-def create_file(db: Session, filename: str, original_size: int, compressed_size: int, 
-                algorithm: str, owner_id: int):
+async def create_file(db: AsyncSession, filename: str, original_size: int, compressed_size: int, 
+                      algorithm: str, owner_id: int):
     compression_ratio = ((original_size - compressed_size) / original_size) * 100
     db_file = models.File(
         filename=filename,
@@ -46,23 +59,47 @@ def create_file(db: Session, filename: str, original_size: int, compressed_size:
         owner_id=owner_id
     )
     db.add(db_file)
-    db.commit()
-    db.refresh(db_file)
+    await db.commit()
+    await db.refresh(db_file)
     return db_file
 
-def get_user_files(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.File)\
-        .filter(models.File.owner_id == user_id)\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
+def encode_cursor(file: models.File) -> str:
+    return f"{file.created_at.isoformat()}_{file.id}"
 
-def get_file(db: Session, file_id: int):
-    return db.query(models.File).filter(models.File.id == file_id).first()
+def decode_cursor(cursor: str):
+    try:
+        created_at, file_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), int(file_id)
+    except ValueError:
+        raise ValueError("无效的分页游标")
+
+async def _page_user_files(db: AsyncSession, user_id: int, skip: int, limit: int,
+                           cursor: Optional[str], descending: bool):
+    # 按 (owner_id, created_at, id) 索引游标分页，翻到多深都只读取一页的数据
+    key = tuple_(models.File.created_at, models.File.id)
+    query = select(models.File).where(models.File.owner_id == user_id)
+    if descending:
+        query = query.order_by(models.File.created_at.desc(), models.File.id.desc())
+    else:
+        query = query.order_by(models.File.created_at, models.File.id)
+    if cursor:
+        position = decode_cursor(cursor)
+        query = query.where(key < position if descending else key > position)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+async def get_user_files(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100,
+                         cursor: Optional[str] = None):
+    return await _page_user_files(db, user_id, skip, limit, cursor, descending=False)
+
+async def get_file(db: AsyncSession, file_id: int):
+    return await db.get(models.File, file_id)
 
 # 文件分享相关操作
-def create_file_share(
-    db: Session,
+async def create_file_share(
+    db: AsyncSession,
     file_id: int,
     share_id: str,
     password: Optional[str],
@@ -80,56 +117,89 @@ def create_file_share(
         is_password_protected=is_password_protected
     )
     db.add(db_share)
-    db.commit()
-    db.refresh(db_share)
+    await db.commit()
+    await db.refresh(db_share)
     return db_share
 
-def get_file_share(db: Session, share_id: str):
-    return db.query(models.FileShare)\
-        .filter(models.FileShare.share_id == share_id)\
-        .first()
+async def get_file_share(db: AsyncSession, share_id: str):
+    result = await db.execute(
+        select(models.FileShare).where(models.FileShare.share_id == share_id)
+    )
+    return result.scalars().first()
 
-def get_user_shares(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.FileShare)\
+async def get_user_shares(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100,
+                          cursor: Optional[str] = None):
+    # 一次查询同时取出分享对应的文件；传入 cursor（上一页最后一个分享的ID）时按ID游标分页，
+    # 不再扫描前面的行
+    query = select(models.FileShare)\
         .join(models.File, models.FileShare.file_id == models.File.id)\
-        .filter(models.File.owner_id == user_id)\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
-
-def delete_share(db: Session, share_id: int, user_id: int):
-    share = db.query(models.FileShare)\
-        .filter(models.FileShare.id == share_id)\
-        .join(models.File, models.FileShare.file_id == models.File.id)\
-        .filter(models.File.owner_id == user_id)\
-        .first()
+        .options(contains_eager(models.FileShare.file))\
+        .where(models.File.owner_id == user_id)\
+        .order_by(models.FileShare.id)
+    if cursor is not None:
+        try:
+            after_id = int(cursor)
+        except ValueError:
+            raise ValueError("无效的分页游标")
+        query = query.where(models.FileShare.id > after_id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+async def delete_share(db: AsyncSession, share_id: int, user_id: int):
+    result = await db.execute(
+        select(models.FileShare)
+        .join(models.File, models.FileShare.file_id == models.File.id)
+        .where(models.FileShare.id == share_id, models.File.owner_id == user_id)
+    )
+    share = result.scalars().first()
         
     if share:
-        db.delete(share)
-        db.commit()
-        return True
-    return False
-
-def update_share_download_count(db: Session, share_id: str):
-    db_share = get_file_share(db, share_id)
-    if db_share:
-        db_share.current_downloads += 1
-        db.commit()
-        db.refresh(db_share)
-    return db_share
+        await db.delete(share)
+        await db.commit()
+        shares.share_cache.invalidate(share.share_id)
+        return share
+    return None
+
+async def update_share_download_count(db: AsyncSession, share_id: str) -> bool:
+    """原子地增加一次下载次数，达到上限时不更新并返回 False"""
+    FileShare = models.FileShare
+    result = await db.execute(
+        update(FileShare)
+        .where(FileShare.share_id == share_id,
+               or_(FileShare.max_downloads == -1,
+                   FileShare.current_downloads < FileShare.max_downloads))
+        .values(current_downloads=FileShare.current_downloads + 1)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount > 0
 
-def delete_expired_shares(db: Session):
+async def add_share_download_counts(db: AsyncSession, counts: dict):
+    """批量写回内存中累加的下载次数：{share_id: 次数}"""
+    table = models.FileShare.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.share_id == bindparam("b_share_id"))
+        .values(current_downloads=table.c.current_downloads + bindparam("b_count")),
+        [{"b_share_id": share_id, "b_count": count} for share_id, count in counts.items()]
+    )
+    await db.commit()
+
+async def delete_expired_shares(db: AsyncSession):
     now = datetime.utcnow()
-    expired_shares = db.query(models.FileShare)\
-        .filter(models.FileShare.expires_at < now)\
-        .all()
+    result = await db.execute(
+        select(models.FileShare).where(models.FileShare.expires_at < now)
+    )
     
-    for share in expired_shares:
-        db.delete(share)
+    for share in result.scalars().all():
+        await db.delete(share)
+        shares.share_cache.invalidate(share.share_id)
     
-    db.commit()
+    await db.commit()
 
-def check_share_validity(db: Session, share: models.FileShare) -> bool:
+def check_share_validity(db: AsyncSession, share: models.FileShare) -> bool:
     if not share:
         return False
     
@@ -144,10 +214,6 @@ def check_share_validity(db: Session, share: models.FileShare) -> bool:
     return True
 
 # 压缩历史记录相关操作
-def get_user_compression_history(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.File)\
-        .filter(models.File.owner_id == user_id)\
-        .order_by(models.File.created_at.desc())\
-        .offset(skip)\
-        .limit(limit)\
-        .all() 
\ No newline at end of file
+async def get_user_compression_history(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100,
+                                       cursor: Optional[str] = None):
+    return await _page_user_files(db, user_id, skip, limit, cursor, descending=True) 
\ No newline at end of file
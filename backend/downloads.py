@@ -0,0 +1,228 @@
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from cache import TTLCache
+from storage import hash_file
+
+RANGE_CHUNK_SIZE = 64 * 1024
+# 单个请求最多允许的区间数，超过时按整个文件返回
+MAX_RANGES = int(os.getenv("DOWNLOAD_MAX_RANGES", "16"))
+
+
+class ETagCache:
+    """不在blob存储中的文件（旧文件、解压结果）的内容哈希缓存
+
+    按 (路径, 修改时间, 大小) 缓存，文件被改写后自动重新计算，条目不过期。
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self._entries = TTLCache(max_entries=max_entries)
+
+    async def get(self, path: str, stat: os.stat_result) -> str:
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self._entries.get(key)
+        if digest is None:
+            digest, _ = await run_in_threadpool(hash_file, path)
+            self._entries.put(key, digest)
+        return digest
+
+
+etag_cache = ETagCache()
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """解析 Range 请求头，返回按顺序合并后的闭区间列表
+
+    请求头不存在、格式不对或区间过多时返回 None（按整个文件返回）；
+    所有区间都无法满足时返回空列表。
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+            return None
+        if first == "":
+            # 后缀区间：最后 N 个字节
+            if last == "":
+                return None
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            if last:
+                end = int(last)
+                if end < start:
+                    return None
+                end = min(end, size - 1)
+            else:
+                end = size - 1
+        if start < size:
+            ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # 合并重叠或相邻的区间
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match 使用弱比较"""
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def _not_modified_since(header: Optional[str], mtime: float) -> bool:
+    if not header:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def _if_range_matches(header: Optional[str], etag: str, mtime: float) -> bool:
+    """If-Range 使用强比较；给出日期时必须与 Last-Modified 完全一致"""
+    if header is None:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        return header == etag
+    try:
+        return int(parsedate_to_datetime(header).timestamp()) == int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _iter_file(path: str, ranges: List[Tuple[int, int]], parts: Optional[List[bytes]] = None,
+               closing: bytes = b""):
+    with open(path, "rb") as file:
+        for index, (start, end) in enumerate(ranges):
+            if parts:
+                yield parts[index]
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file.read(min(RANGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+    if closing:
+        yield closing
+
+
+async def file_response(
+    request: Request,
+    path: str,
+    filename: str,
+    digest: Optional[str] = None,
+    media_type: str = "application/octet-stream"
+) -> Response:
+    """返回支持 Range / If-Range / 条件请求的文件响应
+
+    ETag 由内容的SHA-256生成：blob存储中的文件直接使用其哈希，其他文件计算
+    后缓存。同一内容的 ETag 在不同路径、不同用户之间一致，客户端可以放心续传。
+    """
+    stat = await run_in_threadpool(os.stat, path)
+    size = stat.st_size
+    if digest is None:
+        digest = await etag_cache.get(path, stat)
+    etag = f'"{digest}"'
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        "accept-ranges": "bytes",
+    }
+
+    # 条件请求：内容未变化时返回 304
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif _not_modified_since(request.headers.get("if-modified-since"), stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    ranges = None
+    if _if_range_matches(request.headers.get("if-range"), etag, stat.st_mtime):
+        ranges = parse_range(request.headers.get("range"), size)
+
+    if ranges is None:
+        response = FileResponse(path, filename=filename, media_type=media_type, headers=headers, stat_result=stat)
+        response.range_start = 0
+        return response
+
+    headers["content-disposition"] = content_disposition(filename)
+    if not ranges:
+        headers["content-range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(end - start + 1)
+        response = StreamingResponse(_iter_file(path, ranges), status_code=206,
+                                     media_type=media_type, headers=headers)
+        response.range_start = start
+        return response
+
+    # 多个区间：multipart/byteranges
+    boundary = secrets.token_hex(16)
+    parts = [
+        (f"\r\n--{boundary}\r\n"
+         f"Content-Type: {media_type}\r\n"
+         f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+        for start, end in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    headers["content-length"] = str(
+        sum(len(part) for part in parts) + sum(end - start + 1 for start, end in ranges) + len(closing)
+    )
+    response = StreamingResponse(_iter_file(path, ranges, parts, closing), status_code=206,
+                                 media_type=f"multipart/byteranges; boundary={boundary}", headers=headers)
+    response.range_start = ranges[0][0]
+    return response
+
+
+def starts_from_beginning(response: Response) -> bool:
+    """响应是否从文件开头发送（完整下载，或续传/分段下载的第一段）"""
+    return getattr(response, "range_start", None) == 0
+
+
+def sends_content(response: Response) -> bool:
+    """响应是否发送文件内容（200 或 206），304、416 不发送"""
+    return getattr(response, "range_start", None) is not None
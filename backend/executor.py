@@ -0,0 +1,142 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class ComputeExecutor:
+    """压缩/解压任务的计算执行器
+
+    纯Python编解码（LZ77、Huffman）在进程池中运行；zlib、AES和文件读写会释放GIL，
+    放在线程池中运行。事件循环只负责调度和发送进度；max_jobs 是任务调度器
+    默认同时运行的任务数。
+    """
+
+    def __init__(self, process_workers=None, thread_workers=None, max_jobs=None):
+        self.process_workers = process_workers or os.cpu_count() or 1
+        self.thread_workers = thread_workers or min(32, self.process_workers + 4)
+        self.max_jobs = max_jobs or self.process_workers
+        self._process_pool = None
+        self._thread_pool = None
+
+    @property
+    def process_pool(self):
+        if self._process_pool is None:
+            # spawn 避免在已有事件循环和线程的进程中 fork
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._process_pool
+
+    @property
+    def thread_pool(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self.thread_workers,
+                thread_name_prefix="compute"
+            )
+        return self._thread_pool
+
+    def attach(self, compressor):
+        """让压缩器的数据块在进程池中处理，读写和加解密在线程池中处理"""
+        compressor.set_executor(self.process_pool, self.thread_pool)
+        return compressor
+
+    async def run_in_thread(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_pool, func, *args)
+
+    def shutdown(self):
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+
+
+class ExecutorBusyError(Exception):
+    """等待执行的任务已达上限"""
+
+
+class BoundedExecutor:
+    """固定线程数、限制排队长度的执行器，用于密码哈希这类会阻塞事件循环的短任务
+
+    排队（含正在执行）的任务超过 max_pending 时立即拒绝，不让突发请求无限堆积；
+    stats() 返回提交、拒绝、完成数量以及排队和执行耗时。
+    """
+
+    def __init__(self, name: str, workers: int = 2, max_pending: int = 64):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = None
+        self._pending = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._run_time = 0.0
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._pool
+
+    def _timed(self, func, args, queued_at):
+        started_at = time.perf_counter()
+        wait_time = started_at - queued_at
+        try:
+            return func(*args)
+        finally:
+            self._wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+            self._run_time += time.perf_counter() - started_at
+
+    async def run(self, func, *args):
+        if self._pending >= self.max_pending:
+            self._rejected += 1
+            raise ExecutorBusyError(f"{self.name} 执行器繁忙，请稍后重试")
+        self._pending += 1
+        self._submitted += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.pool, self._timed, func, args, time.perf_counter())
+        finally:
+            self._pending -= 1
+            self._completed += 1
+
+    def stats(self) -> dict:
+        completed = self._completed or 1
+        return {
+            "pending": self._pending,
+            "submitted": self._submitted,
+            "rejected": self._rejected,
+            "completed": self._completed,
+            "avg_wait_ms": round(self._wait_time / completed * 1000, 2),
+            "max_wait_ms": round(self._max_wait_time * 1000, 2),
+            "avg_run_ms": round(self._run_time / completed * 1000, 2),
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+compute_executor = ComputeExecutor(
+    process_workers=int(os.getenv("COMPUTE_PROCESS_WORKERS", "0")) or None,
+    thread_workers=int(os.getenv("COMPUTE_THREAD_WORKERS", "0")) or None,
+    max_jobs=int(os.getenv("COMPUTE_MAX_JOBS", "0")) or None
+)
+
+# bcrypt 在线程中运行时释放GIL，单独的线程池避免登录高峰占满计算线程池
+password_executor = BoundedExecutor(
+    "password",
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+)
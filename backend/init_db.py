@@ -1,23 +1,19 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from models import Base
-from database import SQLALCHEMY_DATABASE_URL
+from database import SQLALCHEMY_DATABASE_URL, engine
 
 def init_db():
-    # 如果数据库文件已存在，先删除它
-    db_path = os.path.join(os.path.dirname(__file__), "sql_app.db")
-    if os.path.exists(db_path):
-        os.remove(db_path)
-    
-    # 创建数据库引擎
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args={"check_same_thread": False}
-    )
+    # 如果数据库文件已存在，先删除它（包括WAL模式的 -wal / -shm 文件）
+    if make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite":
+        db_path = os.path.join(os.path.dirname(__file__), "sql_app.db")
+        for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
     
     # 创建所有表
     Base.metadata.create_all(bind=engine)
     print("数据库初始化完成！")
 
 if __name__ == "__main__":
-    init_db() 
\ No newline at end of file
+    init_db()
\ No newline at end of file
@@ -1,13 +1,14 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, Form, Query, Depends, status
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, Form, Query, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
 import os
 import time
-import json
-import asyncio
 import uuid
 import random
 import string
@@ -17,7 +18,13 @@ import struct
 import zipfile
 from typing import Optional, Dict, List
 import uvicorn
-from compression import LZ77Compressor, HuffmanCompressor, ZipCompressor, CombinedCompressor
+from executor import compute_executor, password_executor, ExecutorBusyError
+from scheduler import job_scheduler, JobWatcher, COMPRESSORS, SchedulerFullError
+from progress import progress_bus
+from storage import blob_store, HashingWriter
+from downloads import file_response, sends_content, starts_from_beginning
+from uploads import upload_manager
+from shares import share_counter, share_cache, ResolvedShare
 import socket
 import secrets
 from datetime import datetime, timedelta
@@ -30,6 +37,8 @@ import crud
 import auth
 import database
 
+logger = logging.getLogger(__name__)
+
 # 创建数据库表
 models.Base.metadata.create_all(bind=database.engine)
 
@@ -42,6 +51,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Range", "Content-Disposition", "ETag", "Accept-Ranges", "X-Next-Cursor"],
 )
 
 # 创建上传文件存储目录
@@ -49,14 +59,39 @@ UPLOAD_DIR = "uploads"
 COMPRESSED_DIR = "compressed"
 DECOMPRESSED_DIR = "decompressed"
 SHARED_DIR = "shared"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 分享的存储方式：reference 只记录数据库引用；hardlink 在分享目录建立硬链接，
+# 源文件被覆盖或删除后分享仍可下载。两种方式都不复制文件内容
+SHARE_STORAGE = os.getenv("SHARE_STORAGE", "reference")
+# 分享链接的基础地址，例如 https://files.example.com；未配置时使用启动时解析的本机IP
+SHARE_BASE_URL = os.getenv("SHARE_BASE_URL")
 for directory in [UPLOAD_DIR, COMPRESSED_DIR, DECOMPRESSED_DIR, SHARED_DIR]:
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-# 存储WebSocket连接和压缩任务
-active_connections: Dict[str, WebSocket] = {}
-compression_tasks: Dict[str, asyncio.Task] = {}
-stop_flags: Dict[str, bool] = {}
+# 压缩/解压任务写入任务表，由调度器排队执行；计算在独立的进程池和线程池中进行
+@app.on_event("startup")
+async def start_job_scheduler():
+    await job_scheduler.start()
+    await job_watcher.start()
+    await share_counter.start()
+
+@app.on_event("shutdown")
+async def shutdown_job_scheduler():
+    await job_scheduler.stop()
+    await job_watcher.stop()
+    # 写回内存中尚未保存的分享下载次数
+    await share_counter.stop()
+    compute_executor.shutdown()
+    password_executor.shutdown()
+    # 关闭连接池，aiosqlite 的连接线程会阻止进程退出
+    await database.async_engine.dispose()
+
+# 任务事件只发给订阅了该任务（或该用户）的WebSocket连接
+job_scheduler.set_event_handler(progress_bus.publish)
+# 在其他进程中执行的任务，从任务表查询状态后转发
+job_watcher = JobWatcher(job_scheduler, progress_bus,
+                         poll_interval=float(os.getenv("JOB_WATCH_INTERVAL", "1")))
 
 # 存储分享信息
 shared_files: Dict[str, Dict] = {}
@@ -70,18 +105,123 @@ def generate_password(length=6):
 def generate_share_id():
     return str(uuid.uuid4())
 
-async def send_compression_progress(websocket: WebSocket, data: dict):
+def _copy_upload(source, file_path):
+    source.seek(0)
+    with open(file_path, "wb") as buffer:
+        writer = HashingWriter(buffer)
+        shutil.copyfileobj(source, writer, UPLOAD_CHUNK_SIZE)
+        return writer.hexdigest(), writer.size
+
+async def save_upload_file(file: UploadFile, db: AsyncSession):
+    """把上传文件按块写入blob存储，同时计算内容哈希，返回 (哈希, 大小)
+
+    复制在线程池中进行，每次只占用一个块的内存；内容相同的文件只保存一份，
+    返回时已为调用方增加一个引用。
+    """
+    temp_path = blob_store.temp_path()
     try:
-        await websocket.send_text(json.dumps(data))
-    except Exception as e:
-        print(f"发送进度更新失败: {e}")
+        digest, size = await run_in_threadpool(_copy_upload, file.file, temp_path)
+        await blob_store.ingest(db, temp_path, digest, size)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return digest, size
+
+def parse_task_id(task_id: Optional[str]) -> Optional[str]:
+    """客户端可以自己生成任务ID（UUID），先用它订阅WebSocket再上传，进度只发给该连接"""
+    if task_id is None:
+        return None
+    try:
+        return str(uuid.UUID(task_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="任务ID无效")
+
+async def submit_uploaded_file(db: AsyncSession, owner_id: int, kind: str, algorithm: str,
+                               filename: str, digest: str, file_size: int,
+                               task_id: Optional[str] = None) -> dict:
+    """把已存入blob存储的上传文件提交为压缩或解压任务，提交失败时释放文件引用"""
+    try:
+        if task_id and await db.get(models.CompressionJob, task_id):
+            raise HTTPException(status_code=409, detail="任务ID已存在")
+
+        if kind == "compress":
+            # 由调度器执行压缩；相同内容和参数的结果会直接复用
+            job = await job_scheduler.submit(
+                db,
+                kind="compress",
+                algorithm=algorithm,
+                filename=filename,
+                input_path=blob_store.path(digest),
+                output_path=None,
+                owner_id=owner_id,
+                original_size=file_size,
+                source_hash=digest,
+                job_id=task_id
+            )
+            # 用任务ID订阅的连接之后只接收该任务的消息
+            progress_bus.bind(job.id)
+            return {
+                "message": "文件上传成功，开始压缩",
+                "filename": f"{filename}.compressed",
+                "algorithm": algorithm,
+                "originalSize": file_size,
+                "taskId": job.id
+            }
+
+        # 从压缩文件名中获取原始文件名；每个任务单独一个解压目录，同名文件互不覆盖
+        original_filename = filename.replace(".compressed", "")
+        job_id = task_id or str(uuid.uuid4())
+        job = await job_scheduler.submit(
+            db,
+            kind="decompress",
+            algorithm=algorithm,
+            filename=original_filename,
+            input_path=blob_store.path(digest),
+            output_path=os.path.join(DECOMPRESSED_DIR, job_id, original_filename),
+            owner_id=owner_id,
+            original_size=file_size,
+            source_hash=digest,
+            job_id=job_id
+        )
+        progress_bus.bind(job.id)
+        return {
+            "message": "文件上传成功，开始解压",
+            "filename": original_filename,
+            "algorithm": algorithm,
+            "taskId": job.id
+        }
+    except Exception:
+        await blob_store.release(db, digest)
+        raise
+
+def stored_file_path(db_file: models.File) -> str:
+    # 新记录的压缩结果在blob存储中，旧记录仍在压缩目录
+    if db_file.blob_hash:
+        return blob_store.path(db_file.blob_hash)
+    return os.path.join(COMPRESSED_DIR, f"{db_file.filename}.compressed")
+
+def shared_file_path(share_id: str, filename: str) -> str:
+    return os.path.join(SHARED_DIR, share_id, f"{filename}.compressed")
+
+def link_shared_file(source_file_path: str, share_id: str, filename: str) -> bool:
+    """为分享建立硬链接，文件系统不支持时返回 False，分享改为只引用源文件"""
+    share_dir = os.path.join(SHARED_DIR, share_id)
+    os.makedirs(share_dir, exist_ok=True)
+    try:
+        os.link(source_file_path, shared_file_path(share_id, filename))
+        return True
+    except OSError as e:
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 创建硬链接失败，改为引用源文件: {str(e)}")
+        shutil.rmtree(share_dir, ignore_errors=True)
+        return False
 
 @app.websocket("/ws/compression")
 async def websocket_endpoint(
     websocket: WebSocket,
     token: str = Query(...),
     task_id: str = Query(...),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     try:
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 收到WebSocket连接请求: {task_id}")
@@ -105,10 +245,12 @@ async def websocket_endpoint(
                 await websocket.close(code=4001, reason="无效的token")
                 return
 
-            user = db.query(models.User).filter(models.User.username == username).first()
+            user = await auth.resolve_user(db, username)
             if not user:
                 await websocket.close(code=4001, reason="用户不存在")
                 return
+            # 连接可能保持很久，认证后立即归还数据库连接
+            await db.close()
 
         except (JWTError, ValueError) as e:
             print(f"Token验证错误: {str(e)}")
@@ -117,7 +259,7 @@ async def websocket_endpoint(
 
         await websocket.accept()
         client_id = f"{task_id}_{str(id(websocket))}"
-        active_connections[client_id] = websocket
+        subscriber = progress_bus.subscribe(websocket, task_id, user.id)
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] WebSocket连接建立: {client_id}")
 
         try:
@@ -128,19 +270,29 @@ async def websocket_endpoint(
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] WebSocket错误[{client_id}]: {str(e)}")
         finally:
             print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 连接关闭: {client_id}")
-            if client_id in active_connections:
-                del active_connections[client_id]
+            progress_bus.unsubscribe(subscriber)
     except Exception as e:
         print(f"WebSocket处理错误: {str(e)}")
         if not websocket.client_state.disconnected:
             await websocket.close(code=1011, reason=str(e))
 
+def password_busy(e: ExecutorBusyError) -> HTTPException:
+    logger.warning("密码哈希队列已满: %s", password_executor.stats())
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": "1"}
+    )
+
 @app.post("/user/login")
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    try:
+        user = await auth.authenticate_user(db, form_data.username, form_data.password)
+    except ExecutorBusyError as e:
+        raise password_busy(e)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -166,7 +318,7 @@ async def login(
 @app.post("/user/refresh_token")
 async def refresh_token(
     refresh_token: str = Form(...),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     username = auth.verify_refresh_token(refresh_token)
     if not username:
@@ -176,7 +328,7 @@ async def refresh_token(
         )
 
     # 验证用户是否存在
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = await auth.resolve_user(db, username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -195,27 +347,31 @@ async def refresh_token(
     }
 
 @app.post("/user/register", response_model=schemas.User)
-async def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_db)):
     # 检查用户名是否已存在
-    db_user = crud.get_user_by_username(db, username=user.username)
+    db_user = await crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="用户名已存在"
         )
     
-    # 创建新用户
-    return crud.create_user(db=db, username=user.username, password=user.password)
+    # 创建新用户，密码哈希在独立线程池中计算
+    try:
+        hashed_password = await auth.get_password_hash_async(user.password)
+    except ExecutorBusyError as e:
+        raise password_busy(e)
+    return await crud.create_user(db=db, username=user.username, hashed_password=hashed_password)
 
 # 处理前端RegisterForm提交的表单数据
 @app.post("/user/create_user")
 async def create_user(
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     # 检查用户名是否已存在
-    db_user = crud.get_user_by_username(db, username=username)
+    db_user = await crud.get_user_by_username(db, username=username)
     if db_user:
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -223,9 +379,17 @@ async def create_user(
         )
     
     try:
-        # 创建新用户
-        crud.create_user(db=db, username=username, password=password)
+        # 创建新用户，密码哈希在独立线程池中计算
+        hashed_password = await auth.get_password_hash_async(password)
+        await crud.create_user(db=db, username=username, hashed_password=hashed_password)
         return {"code": 0, "msg": "注册成功"}
+    except ExecutorBusyError as e:
+        busy = password_busy(e)
+        return JSONResponse(
+            status_code=busy.status_code,
+            content={"code": 1, "msg": busy.detail},
+            headers=busy.headers
+        )
     except Exception as e:
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -242,22 +406,29 @@ async def get_current_user_info(
 async def update_user_info(
     user_update: schemas.UserUpdate,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     # 如果要更新用户名，先检查新用户名是否已存在
     if user_update.username:
-        db_user = crud.get_user_by_username(db, username=user_update.username)
+        db_user = await crud.get_user_by_username(db, username=user_update.username)
         if db_user and db_user.id != current_user.id:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="用户名已被使用"
             )
     
-    updated_user = crud.update_user(
+    hashed_password = None
+    if user_update.password:
+        try:
+            hashed_password = await auth.get_password_hash_async(user_update.password)
+        except ExecutorBusyError as e:
+            raise password_busy(e)
+
+    updated_user = await crud.update_user(
         db=db,
         user_id=current_user.id,
         username=user_update.username,
-        password=user_update.password
+        hashed_password=hashed_password
     )
     
     if not updated_user:
@@ -278,336 +449,268 @@ async def logout():
 async def upload_file(
     file: UploadFile = File(...),
     algorithm: str = Form("algorithm"),
-    db: Session = Depends(database.get_db),
+    task_id: Optional[str] = Form(None),
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     try:
-        # 生成任务ID
-        task_id = str(uuid.uuid4())
-        stop_flags[task_id] = False
-
-        # 保存上传的文件
+        task_id = parse_task_id(task_id)
         if file.filename is not None:
-            file_path = os.path.join(UPLOAD_DIR, file.filename)
+            filename = os.path.basename(file.filename)
         else:
             raise HTTPException(status_code=400, detail="文件名不能为空")
 
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-
-        # 获取文件大小
-        file_size = os.path.getsize(file_path)
-
-        print(f"接收到文件: {file.filename}")
-
-        # 根据选择的算法进行压缩
-        if algorithm == "lz77":
-            compressor = LZ77Compressor()
-        elif algorithm == "huffman":
-            compressor = HuffmanCompressor()
-        elif algorithm == "zip":
-            compressor = ZipCompressor()
-        elif algorithm == "combined":
-            compressor = CombinedCompressor()
-        else:
+        if algorithm not in COMPRESSORS:
             raise HTTPException(status_code=400, detail="不支持的压缩算法")
 
-        # 设置进度回调
-        if hasattr(compressor, 'set_progress_callback'):
-            async def progress_callback(data):
-                # 检查是否应该停止
-                if stop_flags.get(task_id, True):
-                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 任务 {task_id} 被用户停止")
-                    raise asyncio.CancelledError()
-
-                # 向所有连接的客户端发送进度更新
-                for ws in active_connections.values():
-                    await send_compression_progress(ws, data)
-
-            compressor.set_progress_callback(progress_callback)
-
-        compressed_path = os.path.join(COMPRESSED_DIR, f"{file.filename}.compressed")
-
-        # 在后台任务中执行压缩
-        compression_task = asyncio.create_task(compress_file(compressor, file_path, compressed_path, task_id))
-        compression_tasks[task_id] = {
-            "task": compression_task,
-            "user_id": current_user.id,
-            "original_size": file_size,
-            "algorithm": algorithm
-        }
+        # 按内容保存上传的文件，分块写入磁盘，不把整个文件读入内存
+        digest, file_size = await save_upload_file(file, db)
 
-        return {
-            "message": "文件上传成功，开始压缩",
-            "filename": f"{file.filename}.compressed",
-            "algorithm": algorithm,
-            "originalSize": file_size,
-            "taskId": task_id
-        }
+        print(f"接收到文件: {filename}")
+
+        return await submit_uploaded_file(db, current_user.id, "compress", algorithm, filename, digest, file_size,
+                                          task_id)
+    except HTTPException:
+        raise
+    except SchedulerFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/stop_compression/{task_id}")
-async def stop_compression(task_id: str):
-    if task_id not in compression_tasks:
+@app.get("/jobs/{task_id}", response_model=schemas.CompressionJob)
+async def get_job(
+    task_id: str,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    # 任务可能在其他进程中执行，状态和进度从任务表读取
+    result = await db.execute(
+        select(models.CompressionJob)
+        .where(models.CompressionJob.id == task_id,
+               models.CompressionJob.owner_id == current_user.id)
+    )
+    job = result.scalars().first()
+    if not job:
         raise HTTPException(status_code=404, detail="找不到指定的压缩任务")
+    return job
 
-    # 设置停止标志
-    stop_flags[task_id] = True
+@app.post("/stop_compression/{task_id}")
+async def stop_compression(
+    task_id: str,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
     print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 收到停止请求: 任务ID {task_id}")
-
-    try:
-        # 等待任务取消，设置超时
-        try:
-            await asyncio.wait_for(compression_tasks[task_id]["task"], timeout=1.0)
-        except asyncio.TimeoutError:
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 停止任务超时: {task_id}")
-            # 即使超时也继续执行清理操作
-    except asyncio.CancelledError:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 任务被取消: {task_id}")
-    except Exception as e:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 停止任务时出错: {str(e)}")
-    finally:
-        # 通知所有客户端压缩已停止
-        for ws in active_connections.values():
-            try:
-                await send_compression_progress(ws, {
-                    'type': 'stopped',
-                    'message': '压缩任务已停止'
-                })
-            except Exception as e:
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 发送停止通知失败: {str(e)}")
-
-        # 清理任务相关资源
-        if task_id in compression_tasks:
-            del compression_tasks[task_id]
-        if task_id in stop_flags:
-            del stop_flags[task_id]
+    # 排队中的任务直接取消；运行中的任务由执行它的工作进程停止并清理
+    job = await job_scheduler.cancel(db, task_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="找不到指定的压缩任务")
+    if job.status not in ("queued", "running", "cancelled"):
+        raise HTTPException(status_code=400, detail="压缩任务已结束")
 
     return {"message": "压缩任务已停止"}
 
-async def compress_file(compressor, input_path, output_path, task_id):
-    try:
-        # 获取任务信息
-        task_info = compression_tasks[task_id]
-        user_id = task_info["user_id"]
-        original_size = task_info["original_size"]
-        algorithm = task_info["algorithm"]
-
-        # 异步压缩
-        if asyncio.iscoroutinefunction(compressor.compress):
-            await compressor.compress(input_path, output_path)
-        else:
-            # 保持向后兼容
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, compressor.compress, input_path, output_path)
-
-        # 获取压缩后的大小
-        compressed_size = os.path.getsize(output_path)
-        compression_ratio = (original_size - compressed_size) / original_size
-
-        # 保存文件信息到数据库
-        db = next(database.get_db())
-        try:
-            file_record = models.File(
-                filename=os.path.basename(input_path),
-                original_size=original_size,
-                compressed_size=compressed_size,
-                compression_ratio=compression_ratio,
-                algorithm=algorithm,
-                owner_id=user_id
-            )
-            db.add(file_record)
-            db.commit()
-            db.refresh(file_record)
-
-            # 发送完成消息
-            await send_compression_progress(active_connections[task_id], {
-                "type": "completed",
-                "progress": 100,
-                "details": {
-                    "original_size": original_size,
-                    "current_size": compressed_size,
-                    "compression_ratio": compression_ratio,
-                    "file_id": file_record.id
-                }
-            })
-
-        except Exception as e:
-            db.rollback()
-            raise e
-        finally:
-            db.close()
-
-    except asyncio.CancelledError:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 压缩任务被取消: {task_id}")
-        # 清理未完成的压缩文件
-        if os.path.exists(output_path):
-            try:
-                os.remove(output_path)
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 已删除未完成的压缩文件: {output_path}")
-            except Exception as e:
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 删除未完成的压缩文件失败: {str(e)}")
-        raise
-    except Exception as e:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 压缩错误: {str(e)}")
-        # 通知客户端压缩失败
-        for ws in active_connections.values():
-            try:
-                await send_compression_progress(ws, {
-                    'type': 'error',
-                    'message': str(e)
-                })
-            except Exception as ws_error:
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 发送错误通知失败: {str(ws_error)}")
-    finally:
-        # 清理任务相关资源
-        if task_id in compression_tasks:
-            del compression_tasks[task_id]
-        if task_id in stop_flags:
-            del stop_flags[task_id]
-
-
 @app.post("/decompress")
 async def decompress_file(
     file: UploadFile = File(...),
     algorithm: str = Form("algorithm"),
+    task_id: Optional[str] = Form(None),
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     try:
-        # 生成任务ID
-        task_id = str(uuid.uuid4())
-        stop_flags[task_id] = False
-
-        # 保存上传的压缩文件
+        task_id = parse_task_id(task_id)
         if file.filename is not None:
             # 确保文件名不包含路径
             filename = os.path.basename(file.filename)
-            file_path = os.path.join(UPLOAD_DIR, filename)
         else:
             raise HTTPException(status_code=400, detail="文件名不能为空")
 
-        # 确保上传目录存在
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-
-        # 根据选择的算法进行解压
-        if algorithm == "lz77":
-            compressor = LZ77Compressor()
-        elif algorithm == "huffman":
-            compressor = HuffmanCompressor()
-        elif algorithm == "zip":
-            compressor = ZipCompressor()
-        elif algorithm == "combined":
-            compressor = CombinedCompressor()
-        else:
+        if algorithm not in COMPRESSORS:
             raise HTTPException(status_code=400, detail="不支持的压缩算法")
 
-        # 从压缩文件名中获取原始文件名
-        original_filename = filename.replace(".compressed", "")
-        decompressed_path = os.path.join(DECOMPRESSED_DIR, original_filename)
-
-        # 确保解压目录存在
-        os.makedirs(DECOMPRESSED_DIR, exist_ok=True)
+        # 按内容保存上传的压缩文件，分块写入磁盘，不把整个文件读入内存
+        digest, file_size = await save_upload_file(file, db)
 
-        # 在后台任务中执行解压
-        decompression_task = asyncio.create_task(decompress_file_task(compressor, file_path, decompressed_path, task_id))
-        compression_tasks[task_id] = {
-            "task": decompression_task,
-            "user_id": current_user.id
-        }
-
-        return {
-            "message": "文件上传成功，开始解压",
-            "filename": original_filename,
-            "algorithm": algorithm,
-            "taskId": task_id
-        }
+        return await submit_uploaded_file(db, current_user.id, "decompress", algorithm, filename, digest, file_size,
+                                          task_id)
+    except HTTPException:
+        raise
+    except SchedulerFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def decompress_file_task(compressor, input_path, output_path, task_id):
+# 可续传的分块上传：创建会话 -> 按偏移上传分块（可乱序、并行、重传）-> 查询进度 -> 提交
+@app.post("/uploads")
+async def create_upload_session(
+    filename: str = Form(...),
+    size: int = Form(...),
+    algorithm: str = Form(...),
+    kind: str = Form("compress"),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    if algorithm not in COMPRESSORS:
+        raise HTTPException(status_code=400, detail="不支持的压缩算法")
+    if kind not in ("compress", "decompress"):
+        raise HTTPException(status_code=400, detail="不支持的任务类型")
+
+    session = await upload_manager.create(
+        db, current_user.id, kind, algorithm, os.path.basename(filename), size
+    )
+    return await upload_manager.status(db, session)
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(
+    upload_id: str,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    session = await upload_manager.get(db, upload_id, current_user.id)
+    return await upload_manager.status(db, session)
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: Optional[int] = Query(None),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    # 偏移量可以放在查询参数或 Upload-Offset 请求头中
+    if offset is None:
+        header = request.headers.get("upload-offset")
+        if header is None or not header.isdigit():
+            raise HTTPException(status_code=400, detail="缺少偏移量")
+        offset = int(header)
+
+    session = await upload_manager.get(db, upload_id, current_user.id)
+    return await upload_manager.write_chunk(db, session, offset, request.stream())
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(
+    upload_id: str,
+    task_id: Optional[str] = None,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    task_id = parse_task_id(task_id)
+    session = await upload_manager.get(db, upload_id, current_user.id)
+    digest, file_size = await upload_manager.finalize(db, session)
+    print(f"接收到文件: {session.filename}")
+
     try:
-        # 异步解压
-        if asyncio.iscoroutinefunction(compressor.decompress):
-            await compressor.decompress(input_path, output_path)
-        else:
-            # 保持向后兼容
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, compressor.decompress, input_path, output_path)
-
-        # 发送完成消息
-        await send_compression_progress(active_connections[task_id], {
-            "type": "completed",
-            "progress": 100,
-            "details": {
-                "filename": os.path.basename(output_path)
-            }
-        })
-
-    except asyncio.CancelledError:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 解压任务被取消: {task_id}")
-        # 清理未完成的解压文件
-        if os.path.exists(output_path):
-            try:
-                os.remove(output_path)
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 已删除未完成的解压文件: {output_path}")
-            except Exception as e:
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 删除未完成的解压文件失败: {str(e)}")
+        result = await submit_uploaded_file(
+            db, current_user.id, session.kind, session.algorithm, session.filename, digest, file_size, task_id
+        )
+    except SchedulerFullError as e:
+        # 文件引用已释放，会话恢复为上传中，客户端稍后可以重新提交
+        await upload_manager.reopen(db, session)
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception:
+        await upload_manager.reopen(db, session)
         raise
-    except Exception as e:
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 解压错误: {str(e)}")
-        # 通知客户端解压失败
-        for ws in active_connections.values():
-            try:
-                await send_compression_progress(ws, {
-                    'type': 'error',
-                    'message': str(e)
-                })
-            except Exception as ws_error:
-                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 发送错误通知失败: {str(ws_error)}")
-    finally:
-        # 清理任务相关资源
-        if task_id in compression_tasks:
-            del compression_tasks[task_id]
-        if task_id in stop_flags:
-            del stop_flags[task_id]
+    await upload_manager.complete(db, session, result["taskId"])
+    return result
 
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(
+    upload_id: str,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_db)
+):
+    session = await upload_manager.get(db, upload_id, current_user.id)
+    await upload_manager.abort(db, session)
+    return {"message": "上传已取消"}
+
+
+async def find_user_download(db: AsyncSession, user_id: int, filename: str):
+    """按文件名查找用户最近的压缩结果或解压结果，返回 (路径, 内容哈希)"""
+    if filename.endswith(".compressed"):
+        db_file = await db.scalar(
+            select(models.File)
+            .where(models.File.owner_id == user_id,
+                   models.File.filename == filename[:-len(".compressed")],
+                   models.File.blob_hash.isnot(None))
+            .order_by(models.File.id.desc())
+            .limit(1)
+        )
+        return (stored_file_path(db_file), db_file.blob_hash) if db_file else (None, None)
+
+    job = await db.scalar(
+        select(models.CompressionJob)
+        .where(models.CompressionJob.owner_id == user_id,
+               models.CompressionJob.kind == "decompress",
+               models.CompressionJob.status == "completed",
+               models.CompressionJob.filename == filename)
+        .order_by(models.CompressionJob.finished_at.desc())
+        .limit(1)
+    )
+    return job.output_path if job else None, None
 
 @app.get("/download/{filename}")
-async def download_file(filename: str):
+async def download_file(
+    filename: str,
+    request: Request,
+    current_user: Optional[models.User] = Depends(auth.get_optional_user),
+    db: AsyncSession = Depends(database.get_db)
+):
     try:
-        # 检查文件是否存在于压缩或解压目录中
-        compressed_path = os.path.join(COMPRESSED_DIR, filename)
-        decompressed_path = os.path.join(DECOMPRESSED_DIR, filename)
-
-        if os.path.exists(compressed_path):
-            return FileResponse(compressed_path, filename=filename)
-        elif os.path.exists(decompressed_path):
-            return FileResponse(decompressed_path, filename=filename)
+        # 登录用户按数据库记录查找自己的文件
+        if current_user:
+            file_path, digest = await find_user_download(db, current_user.id, filename)
+            if file_path and os.path.exists(file_path):
+                return await file_response(request, file_path, filename, digest)
+
+        # 旧文件：检查是否存在于压缩或解压目录中
+        compressed_path = os.path.join(COMPRESSED_DIR, os.path.basename(filename))
+        decompressed_path = os.path.join(DECOMPRESSED_DIR, os.path.basename(filename))
+
+        if os.path.isfile(compressed_path):
+            return await file_response(request, compressed_path, filename)
+        elif os.path.isfile(decompressed_path):
+            return await file_response(request, decompressed_path, filename)
         else:
             raise HTTPException(status_code=404, detail="文件不存在")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+_server_ip = None
+
+def detect_server_ip() -> str:
+    """获取本机IP地址，只在第一次调用时解析，之后使用缓存"""
+    global _server_ip
+    if _server_ip is None:
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(("8.8.8.8", 80))
+            _server_ip = s.getsockname()[0]
+            s.close()
+        except Exception:
+            # 如果获取失败，使用本地回环地址
+            _server_ip = "127.0.0.1"
+    return _server_ip
+
+def build_share_url(share_id: str) -> str:
+    base_url = SHARE_BASE_URL or f"http://{detect_server_ip()}:8000"
+    return f"{base_url.rstrip('/')}/shared/{share_id}/download"
+
+@app.on_event("startup")
+async def resolve_server_ip():
+    await run_in_threadpool(detect_server_ip)
+
 # 获取服务器IP地址
 @app.get("/ip")
 async def get_server_ip():
-    try:
-        # 获取本机IP地址
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return {"ip": ip}
-    except Exception as e:
-        # 如果获取失败，返回本地回环地址
-        return {"ip": "127.0.0.1"}
+    return {"ip": detect_server_ip()}
+
+# 密码哈希执行器的排队长度、拒绝次数和排队/执行耗时
+@app.get("/executors/stats")
+async def get_executor_stats(current_user: models.User = Depends(auth.get_current_user)):
+    return {"password": password_executor.stats()}
 
 # 文件分享相关路由
 @app.post("/share/{file_id}", response_model=schemas.FileShare)
@@ -615,17 +718,17 @@ async def share_file(
     file_id: int,
     share_info: schemas.FileShareCreate,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     try:
         # 检查文件是否存在且属于当前用户
-        db_file = crud.get_file(db, file_id)
+        db_file = await crud.get_file(db, file_id)
         if not db_file or db_file.owner_id != current_user.id:
             raise HTTPException(status_code=404, detail="文件不存在")
 
         # 检查源文件是否存在
         print(db_file.filename)
-        source_file_path = os.path.join(COMPRESSED_DIR, f"{db_file.filename}.compressed")
+        source_file_path = stored_file_path(db_file)
         if not os.path.exists(source_file_path):
             print(f"压缩文件不存在: {source_file_path}")
             raise HTTPException(status_code=404, detail="压缩文件不存在")
@@ -636,18 +739,12 @@ async def share_file(
         if share_info.is_password_protected:
             password = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(6))
 
-        # 创建分享目录
-        share_dir = os.path.join(SHARED_DIR, share_id)
-        if not os.path.exists(share_dir):
-            os.makedirs(share_dir)
-
-        # 复制文件到分享目录，使用原始文件名加算法后缀
-        shared_file_path = os.path.join(share_dir, f"{db_file.filename}.compressed")
-        with open(source_file_path, 'rb') as src, open(shared_file_path, 'wb') as dst:
-            dst.write(src.read())
+        # 分享不复制文件：默认只记录引用，hardlink 模式下建立硬链接
+        if SHARE_STORAGE == "hardlink":
+            link_shared_file(source_file_path, share_id, db_file.filename)
 
         # 创建分享记录
-        db_share = crud.create_file_share(
+        db_share = await crud.create_file_share(
             db=db,
             file_id=file_id,
             share_id=share_id,
@@ -658,8 +755,7 @@ async def share_file(
         )
 
         # 构建完整的分享链接
-        server_ip = await get_server_ip()
-        share_url = f"http://{server_ip['ip']}:8000/shared/{share_id}/download"
+        share_url = build_share_url(share_id)
         
         response_data = {
             "id": db_share.id,
@@ -685,20 +781,45 @@ async def share_file(
             shutil.rmtree(share_dir)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def resolve_share(db: AsyncSession, share_id: str) -> ResolvedShare:
+    """查询分享记录和文件，检查有效性并确定文件路径，结果放入缓存"""
+    share = await crud.get_file_share(db, share_id)
+    if not share:
+        raise HTTPException(status_code=404, detail="分享链接不存在")
+
+    # 验证分享是否有效
+    if not crud.check_share_validity(db, share):
+        raise HTTPException(status_code=400, detail="分享链接已过期或达到下载次数限制")
+
+    # 获取文件
+    db_file = await crud.get_file(db, share.file_id)
+    if not db_file:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    # 构建文件路径：优先使用分享时建立的硬链接，否则引用压缩目录中的文件
+    file_path = shared_file_path(share_id, db_file.filename)
+    if not os.path.exists(file_path):
+        file_path = stored_file_path(db_file)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    resolved = ResolvedShare(share, db_file, file_path)
+    share_cache.put(resolved)
+    return resolved
+
 @app.get("/shared/{share_id}/download")
 async def download_shared_file(
     share_id: str,
+    request: Request,
     password: Optional[str] = None,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     try:
-        # 获取分享记录
-        share = crud.get_file_share(db, share_id)
-        if not share:
-            raise HTTPException(status_code=404, detail="分享链接不存在")
-
-        # 验证分享是否有效
-        if not crud.check_share_validity(db, share):
+        # 热门分享直接使用缓存，不查询数据库
+        share = share_cache.get(share_id)
+        if share is None:
+            share = await resolve_share(db, share_id)
+        if share.exhausted:
             raise HTTPException(status_code=400, detail="分享链接已过期或达到下载次数限制")
 
         # 验证密码
@@ -708,25 +829,31 @@ async def download_shared_file(
             if share.password != password:
                 raise HTTPException(status_code=401, detail="密码错误")
 
-        # 获取文件
-        db_file = crud.get_file(db, share.file_id)
-        if not db_file:
-            raise HTTPException(status_code=404, detail="文件不存在")
-
-        # 构建文件路径
-        file_path = os.path.join(COMPRESSED_DIR, f"{db_file.filename}.compressed")
-        if not os.path.exists(file_path):
+        # 返回文件，支持断点续传和分段下载
+        try:
+            response = await file_response(
+                request,
+                share.file_path,
+                f"{share.filename}.compressed",
+                share.blob_hash
+            )
+        except FileNotFoundError:
+            share_cache.invalidate(share_id)
             raise HTTPException(status_code=404, detail="文件不存在")
 
-        # 更新下载次数
-        crud.update_share_download_count(db, share_id)
+        # 更新下载次数：有上限的分享每个发送内容的响应（包括从中间开始的区间请求）
+        # 都在发送前占用名额，并发下载时最后一个名额只会给一个请求；无上限的分享
+        # 续传和分段下载的后续请求不重复计数。304 响应都不计数
+        if share.max_downloads != -1:
+            counted = sends_content(response)
+        else:
+            counted = starts_from_beginning(response)
+        if counted:
+            if not await share_counter.record(db, share_id, share.max_downloads):
+                share.exhausted = True
+                raise HTTPException(status_code=400, detail="分享链接已过期或达到下载次数限制")
 
-        # 返回文件
-        return FileResponse(
-            file_path,
-            filename=f"{db_file.filename}.compressed",
-            media_type='application/octet-stream'
-        )
+        return response
 
     except HTTPException:
         raise
@@ -737,31 +864,46 @@ async def download_shared_file(
 # 用户文件列表
 @app.get("/files", response_model=List[schemas.File])
 async def get_user_files(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
-    files = crud.get_user_files(db, current_user.id, skip=skip, limit=limit)
+    # 传入上一页响应头 X-Next-Cursor 中的 cursor 获取下一页
+    try:
+        files = await crud.get_user_files(db, current_user.id, skip=skip, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(files) == limit:
+        response.headers["X-Next-Cursor"] = crud.encode_cursor(files[-1])
     return files
 
 # 用户分享列表
 @app.get("/shares", response_model=List[schemas.FileShare])
 async def get_user_shares(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
-    shares = crud.get_user_shares(db, current_user.id, skip=skip, limit=limit)
-    
-    # 为每个分享添加文件名和分享链接
+    # 传入上一页响应头 X-Next-Cursor 中的 cursor 获取下一页
+    try:
+        shares = await crud.get_user_shares(db, current_user.id, skip=skip, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(shares) == limit:
+        response.headers["X-Next-Cursor"] = str(shares[-1].id)
+
+    # 为每个分享添加文件名和分享链接，文件已随分享一起查询
     result = []
     for share in shares:
-        file = crud.get_file(db, share.file_id)
-        server_ip = await get_server_ip()
-        share_url = f"http://{server_ip['ip']}:8000/shared/{share.share_id}/download"
-        
+        file = share.file
+        share_url = build_share_url(share.share_id)
+
         share_dict = {
             "id": share.id,
             "share_id": share.share_id,
@@ -770,7 +912,7 @@ async def get_user_shares(
             "created_at": share.created_at,
             "expires_at": share.expires_at,
             "max_downloads": share.max_downloads,
-            "current_downloads": share.current_downloads,
+            "current_downloads": share.current_downloads + share_counter.pending(share.share_id),
             "is_password_protected": share.is_password_protected,
             "share_url": share_url,
             "file_name": file.filename if file else "未知文件",
@@ -785,22 +927,33 @@ async def get_user_shares(
 async def delete_user_share(
     share_id: int,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
-    success = crud.delete_share(db, share_id, current_user.id)
-    if not success:
+    share = await crud.delete_share(db, share_id, current_user.id)
+    if not share:
         raise HTTPException(status_code=404, detail="分享不存在或无权删除")
+    # hardlink 模式下删除分享目录中的链接
+    share_dir = os.path.join(SHARED_DIR, share.share_id)
+    if os.path.exists(share_dir):
+        await run_in_threadpool(shutil.rmtree, share_dir, True)
     return {"message": "分享已删除"}
 
 # 用户压缩历史记录
 @app.get("/compression-history", response_model=List[schemas.File])
 async def get_compression_history(
+    response: Response,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
-    history = crud.get_user_compression_history(db, current_user.id, skip=skip, limit=limit)
+    try:
+        history = await crud.get_user_compression_history(db, current_user.id, skip=skip, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(history) == limit:
+        response.headers["X-Next-Cursor"] = crud.encode_cursor(history[-1])
     return history
 
 if __name__ == '__main__':
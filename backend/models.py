@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, Boolean, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -9,8 +9,8 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True)
-    hashed_password = Column(String)
+    username = Column(String(255), unique=True, index=True)
+    hashed_password = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
     files = relationship("File", back_populates="owner")
 
@@ -18,26 +18,108 @@ class File(Base):
     __tablename__ = "files"
 
     id = Column(Integer, primary_key=True, index=True)
-    filename = Column(String)
+    filename = Column(String(255))
     original_size = Column(Integer)
     compressed_size = Column(Integer)
     compression_ratio = Column(Float)
-    algorithm = Column(String)
+    algorithm = Column(String(32))
     created_at = Column(DateTime, default=datetime.utcnow)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    source_hash = Column(String(64), index=True)  # 原始文件内容的SHA-256
+    blob_hash = Column(String(64), ForeignKey("blobs.hash"))  # 压缩结果所在的blob，旧记录为空
     owner = relationship("User", back_populates="files")
     shares = relationship("FileShare", back_populates="file")
 
+    __table_args__ = (
+        # 文件列表和压缩历史按 (owner_id, created_at, id) 游标分页
+        Index("ix_files_owner_created", "owner_id", "created_at", "id"),
+    )
+
 class FileShare(Base):
     __tablename__ = "file_shares"
 
     id = Column(Integer, primary_key=True, index=True)
-    share_id = Column(String, unique=True, index=True)
-    file_id = Column(Integer, ForeignKey("files.id"))
-    password = Column(String)
+    share_id = Column(String(36), unique=True, index=True)
+    file_id = Column(Integer, ForeignKey("files.id"), index=True)
+    password = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
     expires_at = Column(DateTime)
     max_downloads = Column(Integer, default=-1)
     current_downloads = Column(Integer, default=0)
     is_password_protected = Column(Boolean, default=True)
-    file = relationship("File", back_populates="shares") 
\ No newline at end of file
+    file = relationship("File", back_populates="shares") 
+
+class CompressionJob(Base):
+    __tablename__ = "compression_jobs"
+
+    id = Column(String(36), primary_key=True, index=True)
+    kind = Column(String(16))  # compress / decompress
+    status = Column(String(16), default="queued")  # queued / running / completed / failed / cancelled
+    priority = Column(Integer, default=0)  # 数值越小越先执行，按文件大小分级
+    algorithm = Column(String(32))
+    filename = Column(String(255))
+    input_path = Column(String(1024))
+    output_path = Column(String(1024))
+    original_size = Column(Integer)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    source_hash = Column(String(64))  # 输入文件所在的blob，任务结束时释放引用
+    worker_id = Column(String(255))
+    attempts = Column(Integer, default=0)
+    cancel_requested = Column(Boolean, default=False)
+    progress = Column(Float, default=0)
+    error = Column(Text)
+    result_file_id = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_compression_jobs_status_priority", "status", "priority", "created_at"),
+    )
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    hash = Column(String(64), primary_key=True)  # 内容的SHA-256
+    size = Column(Integer)
+    ref_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class CompressedResult(Base):
+    __tablename__ = "compressed_results"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source_hash = Column(String(64))
+    algorithm = Column(String(32))
+    params = Column(String(255))  # 影响压缩输出的参数
+    blob_hash = Column(String(64), ForeignKey("blobs.hash"))
+    compressed_size = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("source_hash", "algorithm", "params", name="uq_compressed_results_key"),
+    )
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(36), primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    kind = Column(String(16))  # compress / decompress
+    algorithm = Column(String(32))
+    filename = Column(String(255))
+    total_size = Column(Integer)
+    staging_path = Column(String(1024))
+    status = Column(String(16), default="uploading")  # uploading / finalizing / completed
+    task_id = Column(String(36))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class UploadChunk(Base):
+    __tablename__ = "upload_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String(36), ForeignKey("upload_sessions.id"), index=True)
+    offset = Column(Integer)
+    length = Column(Integer)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, defaultdict, deque
+
+FINAL_TYPES = ('completed', 'stopped', 'error')
+
+
+class Subscriber:
+    """单个WebSocket连接的发送队列
+
+    进度消息只保留最新的一条，完成/停止/错误消息按顺序保留，由独立的发送任务
+    写入连接。客户端接收过慢时只会丢弃旧的进度，不会阻塞压缩任务；单次发送超时
+    则关闭连接。
+    """
+
+    def __init__(self, websocket, task_id: str, user_id: int, send_timeout: float):
+        self.websocket = websocket
+        self.task_id = task_id
+        self.user_id = user_id
+        self.send_timeout = send_timeout
+        # task_id 对应真实任务时只接收该任务的消息
+        self.bound = False
+        self._latest = None
+        self._final = deque()
+        self._ready = asyncio.Event()
+        self._sender = asyncio.create_task(self._run())
+
+    def push(self, text: str, final: bool):
+        if final:
+            self._final.append(text)
+        else:
+            self._latest = text
+        self._ready.set()
+
+    async def _run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._latest is not None or self._final:
+                    if self._latest is not None:
+                        text, self._latest = self._latest, None
+                    else:
+                        text = self._final.popleft()
+                    await asyncio.wait_for(self.websocket.send_text(text), timeout=self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            reason = "客户端接收过慢" if isinstance(e, asyncio.TimeoutError) else str(e)
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 发送进度更新失败，关闭连接: {reason}")
+            try:
+                await self.websocket.close(code=1011)
+            except Exception:
+                pass
+
+    def close(self):
+        self._sender.cancel()
+
+
+class ProgressBus:
+    """按任务和用户分发任务事件
+
+    每条消息只序列化一次，只发给订阅了该任务的连接；订阅时使用的 task_id 不是
+    服务端任务（例如前端在上传前自己生成的ID）的连接，接收同一用户所有任务的消息。
+    同一任务的进度按 max_rate 合并，间隔内只发送最新的一条；结束消息立即发送。
+    """
+
+    def __init__(self, max_rate: float = 10, send_timeout: float = 10):
+        self.min_interval = 1 / max_rate if max_rate > 0 else 0
+        self.send_timeout = send_timeout
+        self._by_task = defaultdict(set)
+        self._by_user = defaultdict(set)
+        self._last_sent = {}
+        self._pending = {}
+        self._timers = {}
+        # 已把结束消息发给订阅者的任务，其他进程转发状态时不再重复发送
+        self._finished = OrderedDict()
+
+    def subscribe(self, websocket, task_id: str, user_id: int) -> Subscriber:
+        subscriber = Subscriber(websocket, task_id, user_id, self.send_timeout)
+        self._by_task[task_id].add(subscriber)
+        self._by_user[user_id].add(subscriber)
+        return subscriber
+
+    def bind(self, task_id: str):
+        """task_id 已确认是服务端任务：订阅者之后只接收该任务的消息"""
+        for subscriber in self._by_task.get(task_id, ()):
+            subscriber.bound = True
+
+    def subscribed_tasks(self):
+        return list(self._by_task)
+
+    def has_finished(self, task_id: str) -> bool:
+        return task_id in self._finished
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscriber.close()
+        for index, key in ((self._by_task, subscriber.task_id), (self._by_user, subscriber.user_id)):
+            subscribers = index.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del index[key]
+
+    async def publish(self, task_id: str, user_id: int, data: dict):
+        if data.get('type') not in FINAL_TYPES:
+            wait = self._last_sent.get(task_id, 0) + self.min_interval - time.monotonic()
+            if wait > 0:
+                # 间隔内的进度只保留最新一条，到时间后发送
+                self._pending[task_id] = (user_id, data)
+                if task_id not in self._timers:
+                    loop = asyncio.get_running_loop()
+                    self._timers[task_id] = loop.call_later(wait, self._flush, task_id)
+                return
+            self._last_sent[task_id] = time.monotonic()
+            self._deliver(task_id, user_id, data, final=False)
+        else:
+            # 任务结束：丢弃未发送的进度，立即发送结束消息
+            self._pending.pop(task_id, None)
+            timer = self._timers.pop(task_id, None)
+            if timer is not None:
+                timer.cancel()
+            self._last_sent.pop(task_id, None)
+            if self._deliver(task_id, user_id, data, final=True):
+                self._finished[task_id] = True
+                if len(self._finished) > 10000:
+                    self._finished.popitem(last=False)
+
+    def _flush(self, task_id: str):
+        self._timers.pop(task_id, None)
+        pending = self._pending.pop(task_id, None)
+        if pending is not None:
+            user_id, data = pending
+            self._last_sent[task_id] = time.monotonic()
+            self._deliver(task_id, user_id, data, final=False)
+
+    def _deliver(self, task_id: str, user_id: int, data: dict, final: bool) -> bool:
+        self.bind(task_id)
+        subscribers = set(self._by_task.get(task_id, ()))
+        for subscriber in self._by_user.get(user_id, ()):
+            if not subscriber.bound:
+                subscribers.add(subscriber)
+        if not subscribers:
+            return False
+
+        text = json.dumps(data)
+        for subscriber in subscribers:
+            subscriber.push(text, final)
+        return True
+
+
+progress_bus = ProgressBus(
+    max_rate=float(os.getenv("PROGRESS_MAX_RATE", "10")),
+    send_timeout=float(os.getenv("PROGRESS_SEND_TIMEOUT", "10"))
+)
@@ -0,0 +1,557 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+import database
+from compression import LZ77Compressor, HuffmanCompressor, ZipCompressor, CombinedCompressor
+from executor import compute_executor
+from storage import blob_store, hash_file
+
+COMPRESSORS = {
+    "lz77": LZ77Compressor,
+    "huffman": HuffmanCompressor,
+    "zip": ZipCompressor,
+    "combined": CombinedCompressor,
+}
+
+# 按文件大小划分优先级，数值越小越先执行
+PRIORITY_CLASSES = [
+    (1024 * 1024, 0),
+    (64 * 1024 * 1024, 1),
+]
+LOW_PRIORITY = 2
+
+
+def priority_for_size(size: int) -> int:
+    for limit, priority in PRIORITY_CLASSES:
+        if size <= limit:
+            return priority
+    return LOW_PRIORITY
+
+
+class SchedulerFullError(Exception):
+    """排队中的任务数超过上限"""
+
+
+class JobScheduler:
+    """基于数据库任务表的压缩/解压任务调度器
+
+    任务保存在 compression_jobs 表中，服务重启后不会丢失。每个工作进程
+    （uvicorn worker 或单独运行的 scheduler.py）轮询任务表，用带状态条件的
+    UPDATE 认领任务，因此可以同时运行多个进程。提交时按队列长度做准入控制，
+    认领时按优先级（小文件优先）排序并限制每个用户同时运行的任务数。
+    """
+
+    def __init__(self, worker_id=None, max_running=None, per_user_limit=2,
+                 max_queued=1000, max_queued_per_user=20, poll_interval=0.5,
+                 heartbeat_interval=5, stale_after=60, max_attempts=3):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.max_running = max_running or compute_executor.max_jobs
+        self.per_user_limit = per_user_limit
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self._running: dict = {}
+        self._cancelled = set()
+        self._loop_task = None
+        self._wakeup = None
+        self._stopping = False
+        self._last_heartbeat = 0
+        self._event_handler = None
+
+    def set_event_handler(self, handler):
+        """设置任务事件（进度、完成、停止、错误）的回调：handler(job_id, user_id, data)"""
+        self._event_handler = handler
+
+    async def _emit(self, job_id, user_id, data):
+        if self._event_handler:
+            try:
+                await self._event_handler(job_id, user_id, data)
+            except Exception as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 发送任务事件失败: {str(e)}")
+
+    def _wakeup_loop(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def submit(self, db, kind: str, algorithm: str, filename: str, input_path: str,
+                     output_path: str, owner_id: int, original_size: int = 0,
+                     source_hash: str = None, job_id: str = None):
+        """提交任务；source_hash 为输入文件的blob，提交前已为任务增加引用，任务结束时释放"""
+        Job = models.CompressionJob
+        queued = await db.scalar(select(func.count(Job.id)).where(Job.status == "queued"))
+        if queued >= self.max_queued:
+            raise SchedulerFullError("任务队列已满，请稍后重试")
+        user_queued = await db.scalar(
+            select(func.count(Job.id)).where(Job.status == "queued", Job.owner_id == owner_id)
+        )
+        if user_queued >= self.max_queued_per_user:
+            raise SchedulerFullError("排队中的任务过多，请等待当前任务完成")
+
+        job = Job(
+            id=job_id or str(uuid.uuid4()),
+            kind=kind,
+            status="queued",
+            priority=priority_for_size(original_size),
+            algorithm=algorithm,
+            filename=filename,
+            input_path=input_path,
+            output_path=output_path,
+            original_size=original_size,
+            owner_id=owner_id,
+            source_hash=source_hash
+        )
+        db.add(job)
+        await db.commit()
+        self._wakeup_loop()
+        return job
+
+    async def cancel(self, db, job_id: str, owner_id: int):
+        Job = models.CompressionJob
+        result = await db.execute(
+            select(Job).where(Job.id == job_id, Job.owner_id == owner_id)
+        )
+        job = result.scalars().first()
+        if not job:
+            return None
+
+        if job.status == "queued":
+            # 条件更新：查询之后任务可能已被其他进程领取，只有仍在排队时才取消
+            cancelled = await db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "queued")
+                .values(status="cancelled", finished_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            if cancelled.rowcount:
+                # 任务不会再执行，由这里释放输入文件的引用
+                await blob_store.release(db, job.source_hash)
+                await self._emit(job_id, owner_id, {'type': 'stopped', 'message': '压缩任务已停止'})
+                await db.refresh(job)
+                return job
+            await db.refresh(job)
+
+        if job.status == "running":
+            # 在其他进程中运行的任务通过心跳检查 cancel_requested 停止
+            await db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "running")
+                .values(cancel_requested=True)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            self._cancel_task(job_id)
+            await db.refresh(job)
+        return job
+
+    def is_running(self, job_id) -> bool:
+        """任务是否在本进程中执行"""
+        return job_id in self._running
+
+    def _cancel_task(self, job_id):
+        # 每个任务只取消一次，避免打断取消后的清理和状态更新
+        task = self._running.get(job_id)
+        if task and job_id not in self._cancelled:
+            self._cancelled.add(job_id)
+            task.cancel()
+
+    async def start(self):
+        if self._loop_task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 任务调度器已启动: {self.worker_id}")
+
+    async def stop(self):
+        self._stopping = True
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        tasks = list(self._running.values())
+        for job_id in list(self._running):
+            self._cancel_task(job_id)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._maintain()
+                while len(self._running) < self.max_running:
+                    job_id = await self._claim_next()
+                    if job_id is None:
+                        break
+                    self._running[job_id] = asyncio.create_task(self._execute(job_id))
+            except Exception as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 任务调度错误: {str(e)}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _maintain(self):
+        # 定期更新本进程任务的心跳，响应其他进程发起的取消，回收失去心跳的任务
+        now = time.monotonic()
+        if now - self._last_heartbeat < self.heartbeat_interval:
+            return
+        self._last_heartbeat = now
+
+        Job = models.CompressionJob
+        utcnow = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            if self._running:
+                job_ids = list(self._running)
+                await db.execute(
+                    update(Job)
+                    .where(Job.id.in_(job_ids), Job.status == "running")
+                    .values(heartbeat_at=utcnow)
+                    .execution_options(synchronize_session=False)
+                )
+                cancelled = await db.scalars(
+                    select(Job.id).where(Job.id.in_(job_ids), Job.cancel_requested.is_(True))
+                )
+                for job_id in cancelled.all():
+                    self._cancel_task(job_id)
+
+            stale_before = utcnow - timedelta(seconds=self.stale_after)
+            exhausted = await db.execute(
+                select(Job.id, Job.source_hash)
+                .where(Job.status == "running", Job.heartbeat_at < stale_before,
+                       Job.attempts >= self.max_attempts)
+            )
+            for job_id, source_hash in exhausted.all():
+                failed = await db.execute(
+                    update(Job)
+                    .where(Job.id == job_id, Job.status == "running")
+                    .values(status="failed", error="工作进程多次中断", finished_at=utcnow)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if failed.rowcount:
+                    await blob_store.release(db, source_hash)
+            await db.execute(
+                update(Job)
+                .where(Job.status == "running", Job.heartbeat_at < stale_before)
+                .values(status="queued", worker_id=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _claim_next(self):
+        Job = models.CompressionJob
+        async with database.AsyncSessionLocal() as db:
+            running = dict((await db.execute(
+                select(Job.owner_id, func.count(Job.id))
+                .where(Job.status == "running")
+                .group_by(Job.owner_id)
+            )).all())
+            candidates = (await db.execute(
+                select(Job.id, Job.owner_id)
+                .where(Job.status == "queued")
+                .order_by(Job.priority, Job.created_at)
+                .limit(50)
+            )).all()
+            for job_id, owner_id in candidates:
+                if running.get(owner_id, 0) >= self.per_user_limit:
+                    continue
+                utcnow = datetime.utcnow()
+                claimed = await db.execute(
+                    update(Job)
+                    .where(Job.id == job_id, Job.status == "queued")
+                    .values(
+                        status="running",
+                        worker_id=self.worker_id,
+                        attempts=Job.attempts + 1,
+                        started_at=utcnow,
+                        heartbeat_at=utcnow
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if claimed.rowcount:
+                    return job_id
+            return None
+
+    async def _update_job(self, job_id, **values):
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(
+                update(models.CompressionJob)
+                .where(models.CompressionJob.id == job_id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _cached_result(self, source_hash, algorithm, params):
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(models.CompressedResult)
+                .where(models.CompressedResult.source_hash == source_hash,
+                       models.CompressedResult.algorithm == algorithm,
+                       models.CompressedResult.params == params)
+            )
+            cached = result.scalars().first()
+            if cached and blob_store.exists(cached.blob_hash):
+                return cached.blob_hash, cached.compressed_size
+            return None
+
+    async def _store_result(self, temp_path, digest, size, source_hash, algorithm, params):
+        """把压缩结果存入blob并登记缓存，缓存记录持有一个引用"""
+        async with database.AsyncSessionLocal() as db:
+            await blob_store.ingest(db, temp_path, digest, size)
+            try:
+                db.add(models.CompressedResult(
+                    source_hash=source_hash,
+                    algorithm=algorithm,
+                    params=params,
+                    blob_hash=digest,
+                    compressed_size=size
+                ))
+                await db.commit()
+            except IntegrityError:
+                # 相同内容已由其他任务缓存
+                await db.rollback()
+                await blob_store.release(db, digest)
+
+    async def _create_file_record(self, filename, original_size, blob_hash, compressed_size,
+                                  algorithm, user_id, source_hash):
+        compression_ratio = (original_size - compressed_size) / original_size if original_size else 0
+        async with database.AsyncSessionLocal() as db:
+            if not await blob_store.add_ref(db, blob_hash):
+                raise ValueError("压缩结果不存在")
+            file_record = models.File(
+                filename=filename,
+                original_size=original_size,
+                compressed_size=compressed_size,
+                compression_ratio=compression_ratio,
+                algorithm=algorithm,
+                owner_id=user_id,
+                source_hash=source_hash,
+                blob_hash=blob_hash
+            )
+            db.add(file_record)
+            await db.commit()
+            return file_record.id, compression_ratio
+
+    async def _release_input(self, source_hash):
+        async with database.AsyncSessionLocal() as db:
+            await blob_store.release(db, source_hash)
+
+    async def _execute(self, job_id):
+        async with database.AsyncSessionLocal() as db:
+            job = await db.get(models.CompressionJob, job_id)
+            kind, algorithm, user_id = job.kind, job.algorithm, job.owner_id
+            input_path, output_path = job.input_path, job.output_path
+            filename, original_size = job.filename, job.original_size
+            source_hash = job.source_hash
+
+        compressor = compute_executor.attach(COMPRESSORS[algorithm]())
+        last_saved = time.monotonic()
+
+        async def progress_callback(data):
+            nonlocal last_saved
+            await self._emit(job_id, user_id, data)
+            # 进度每秒最多写一次数据库，供其他进程查询
+            if data.get('type') == 'progress' and time.monotonic() - last_saved >= 1:
+                last_saved = time.monotonic()
+                await self._update_job(job_id, progress=data.get('progress', 0))
+
+        compressor.set_progress_callback(progress_callback)
+        # 压缩结果先写入临时文件，完成后按内容存入blob
+        temp_path = blob_store.temp_path() if kind == "compress" else None
+        requeued = False
+
+        try:
+            if kind == "compress":
+                params = compressor.cache_params()
+                cached = await self._cached_result(source_hash, algorithm, params) if source_hash else None
+                if cached:
+                    # 相同内容和参数已压缩过，直接复用结果
+                    blob_hash, compressed_size = cached
+                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 命中压缩缓存: {job_id}")
+                else:
+                    await compressor.compress(input_path, temp_path)
+                    blob_hash, compressed_size = await compute_executor.run_in_thread(hash_file, temp_path)
+                    await self._store_result(
+                        temp_path, blob_hash, compressed_size, source_hash, algorithm, params)
+
+                # 保存文件信息到数据库
+                file_id, compression_ratio = await self._create_file_record(
+                    filename, original_size, blob_hash, compressed_size, algorithm, user_id, source_hash)
+
+                await self._update_job(job_id, status="completed", progress=100, result_file_id=file_id,
+                                       output_path=blob_store.path(blob_hash), finished_at=datetime.utcnow())
+                await self._emit(job_id, user_id, {
+                    "type": "completed",
+                    "progress": 100,
+                    "details": {
+                        "original_size": original_size,
+                        "current_size": compressed_size,
+                        "compression_ratio": compression_ratio,
+                        "file_id": file_id
+                    }
+                })
+            else:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                await compressor.decompress(input_path, output_path)
+                await self._update_job(job_id, status="completed", progress=100, finished_at=datetime.utcnow())
+                await self._emit(job_id, user_id, {
+                    "type": "completed",
+                    "progress": 100,
+                    "details": {
+                        "filename": os.path.basename(output_path)
+                    }
+                })
+
+        except asyncio.CancelledError:
+            # 清理未完成的输出文件
+            unfinished = temp_path if kind == "compress" else output_path
+            if unfinished and os.path.exists(unfinished):
+                try:
+                    os.remove(unfinished)
+                except Exception as e:
+                    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 删除未完成的文件失败: {str(e)}")
+            if self._stopping:
+                # 进程退出：把任务交还队列，由其他工作进程继续
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 任务交还队列: {job_id}")
+                await self._update_job(job_id, status="queued", worker_id=None)
+                requeued = True
+            else:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 任务被取消: {job_id}")
+                await self._update_job(job_id, status="cancelled", finished_at=datetime.utcnow())
+                await self._emit(job_id, user_id, {'type': 'stopped', 'message': '压缩任务已停止'})
+        except Exception as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 任务错误[{job_id}]: {str(e)}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            await self._update_job(job_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+            await self._emit(job_id, user_id, {'type': 'error', 'message': str(e)})
+        finally:
+            if not requeued:
+                await self._release_input(source_hash)
+            self._running.pop(job_id, None)
+            self._cancelled.discard(job_id)
+            self._wakeup_loop()
+
+
+class JobWatcher:
+    """把在其他进程中执行的任务的状态转发给本进程的WebSocket连接
+
+    任务事件只在执行任务的进程内发布。工作进程单独运行或有多个uvicorn工作进程时，
+    定期查询本进程连接订阅的、不在本进程运行的任务，把任务表中的进度和结束状态
+    发给订阅者。
+    """
+
+    def __init__(self, scheduler, bus, poll_interval=1.0):
+        self.scheduler = scheduler
+        self.bus = bus
+        self.poll_interval = poll_interval
+        self._progress = {}
+        self._loop_task = None
+
+    async def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 查询任务状态失败: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        task_ids = [task_id for task_id in self.bus.subscribed_tasks() if not self.bus.has_finished(task_id)]
+        # 不再订阅的任务不再记录进度
+        self._progress = {task_id: self._progress[task_id] for task_id in task_ids if task_id in self._progress}
+        if not task_ids:
+            return
+
+        Job = models.CompressionJob
+        async with database.AsyncSessionLocal() as db:
+            jobs = (await db.execute(select(Job).where(Job.id.in_(task_ids)))).scalars().all()
+            for job in jobs:
+                # 任务可能由其他进程提交，确认后订阅者不再接收同一用户其他任务的消息
+                self.bus.bind(job.id)
+                if self.scheduler.is_running(job.id):
+                    continue
+                if job.status == "running":
+                    if job.progress and job.progress != self._progress.get(job.id):
+                        self._progress[job.id] = job.progress
+                        await self.bus.publish(job.id, job.owner_id, {
+                            "type": "progress",
+                            "progress": job.progress,
+                            "details": {"original_size": job.original_size}
+                        })
+                elif job.status in ("completed", "failed", "cancelled"):
+                    self._progress.pop(job.id, None)
+                    await self.bus.publish(job.id, job.owner_id, await self._final_event(db, job))
+
+    async def _final_event(self, db, job):
+        if job.status == "failed":
+            return {'type': 'error', 'message': job.error}
+        if job.status == "cancelled":
+            return {'type': 'stopped', 'message': '压缩任务已停止'}
+        if job.kind == "decompress":
+            return {
+                "type": "completed",
+                "progress": 100,
+                "details": {"filename": os.path.basename(job.output_path)}
+            }
+        file_record = await db.get(models.File, job.result_file_id) if job.result_file_id else None
+        return {
+            "type": "completed",
+            "progress": 100,
+            "details": {
+                "original_size": job.original_size,
+                "current_size": file_record.compressed_size if file_record else None,
+                "compression_ratio": file_record.compression_ratio if file_record else None,
+                "file_id": job.result_file_id
+            }
+        }
+
+
+job_scheduler = JobScheduler(
+    per_user_limit=int(os.getenv("SCHEDULER_PER_USER_LIMIT", "2")),
+    max_queued=int(os.getenv("SCHEDULER_MAX_QUEUED", "1000")),
+    max_queued_per_user=int(os.getenv("SCHEDULER_MAX_QUEUED_PER_USER", "20"))
+)
+
+
+async def run_worker():
+    """单独运行的工作进程：只认领并执行任务，不提供HTTP接口"""
+    await job_scheduler.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await job_scheduler.stop()
+        compute_executor.shutdown()
+        await database.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=database.engine)
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        pass
@@ -80,4 +80,20 @@ class CompressionProgress(BaseModel):
 
 # 分享下载相关模型
 class ShareDownload(BaseModel):
-    password: Optional[str] = None 
\ No newline at end of file
+    password: Optional[str] = None 
+
+class CompressionJob(BaseModel):
+    id: str
+    kind: str
+    status: str
+    progress: float
+    algorithm: str
+    filename: str
+    error: Optional[str] = None
+    result_file_id: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
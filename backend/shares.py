@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+
+import crud
+import database
+from cache import TTLCache
+
+# 无下载次数上限的分享，计数在内存中累加后按批写回
+COUNTER_FLUSH_INTERVAL = float(os.getenv("SHARE_COUNTER_FLUSH_INTERVAL", "2"))
+COUNTER_BATCH_SIZE = int(os.getenv("SHARE_COUNTER_BATCH_SIZE", "500"))
+# 分享下载信息的缓存时间（秒），不超过分享的过期时间
+SHARE_CACHE_TTL = float(os.getenv("SHARE_CACHE_TTL", "30"))
+SHARE_CACHE_SIZE = int(os.getenv("SHARE_CACHE_SIZE", "10000"))
+
+
+class ResolvedShare:
+    """下载分享文件需要的信息，不依赖数据库会话"""
+
+    def __init__(self, share, db_file, file_path: str):
+        self.share_id = share.share_id
+        self.expires_at = share.expires_at
+        self.max_downloads = share.max_downloads
+        self.is_password_protected = share.is_password_protected
+        self.password = share.password
+        self.filename = db_file.filename
+        self.blob_hash = db_file.blob_hash
+        self.file_path = file_path
+        # 有上限的分享占用名额失败后置为 True，之后的请求直接拒绝
+        self.exhausted = False
+
+    def is_expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at < datetime.utcnow()
+
+
+class ShareCache:
+    """share_id 到分享下载信息的缓存
+
+    热门分享每次下载都要查询分享记录、文件记录并检查文件是否存在，缓存命中
+    时这些都不再需要，只剩下载次数的计数。条目的有效期不超过分享的过期时间，
+    分享被删除时由 crud 失效；其他进程删除的分享最长 ttl 秒后不再可下载。
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 10000):
+        self.ttl = ttl
+        self._entries = TTLCache(ttl, max_entries)
+
+    def get(self, share_id: str) -> Optional[ResolvedShare]:
+        resolved = self._entries.get(share_id)
+        if resolved is not None and resolved.is_expired():
+            self._entries.pop(share_id)
+            return None
+        return resolved
+
+    def put(self, resolved: ResolvedShare):
+        ttl = self.ttl
+        if resolved.expires_at is not None:
+            ttl = min(ttl, (resolved.expires_at - datetime.utcnow()).total_seconds())
+        self._entries.put(resolved.share_id, resolved, ttl)
+
+    def invalidate(self, share_id: str):
+        self._entries.pop(share_id)
+
+
+class ShareDownloadCounter:
+    """分享下载次数的计数
+
+    有上限的分享在返回文件前用一条条件 UPDATE 占用一次下载名额，多个请求、
+    多个进程并发下载时也不会超过 max_downloads。无上限的分享不需要检查，
+    计数只在内存中累加，由后台任务定期（或累计到 batch_size 次时）合并写回，
+    热门分享不再每次下载都写同一行。
+    """
+
+    def __init__(self, flush_interval: float = 2.0, batch_size: int = 500):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = defaultdict(int)
+        self._pending_total = 0
+        self._flush_lock = asyncio.Lock()
+        self._loop_task = None
+        self._wakeup = None
+
+    async def record(self, db, share_id: str, max_downloads: int) -> bool:
+        """记录一次下载；有上限的分享名额已用完时返回 False"""
+        if max_downloads != -1:
+            return await crud.update_share_download_count(db, share_id)
+
+        self._pending[share_id] += 1
+        self._pending_total += 1
+        if self._pending_total >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def pending(self, share_id: str) -> int:
+        """尚未写回数据库的下载次数，列表中显示时加上"""
+        return self._pending.get(share_id, 0)
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            counts = dict(self._pending)
+            self._pending.clear()
+            self._pending_total = 0
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    await crud.add_share_download_counts(db, counts)
+            except BaseException:
+                # 写回失败（或关闭时被取消）时放回内存，下次再试
+                for share_id, count in counts.items():
+                    self._pending[share_id] += count
+                    self._pending_total += count
+                raise
+
+    async def start(self):
+        if self._loop_task is None:
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 写回分享下载次数失败: {str(e)}")
+
+
+share_counter = ShareDownloadCounter(
+    flush_interval=COUNTER_FLUSH_INTERVAL,
+    batch_size=COUNTER_BATCH_SIZE
+)
+share_cache = ShareCache(ttl=SHARE_CACHE_TTL, max_entries=SHARE_CACHE_SIZE)
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import time
+import uuid
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class HashingWriter:
+    """写入的同时计算内容的SHA-256"""
+
+    def __init__(self, file):
+        self._file = file
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def hash_file(path: str):
+    """分块计算文件的SHA-256，返回 (哈希, 大小)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class BlobStore:
+    """内容寻址的文件存储
+
+    文件按内容的SHA-256保存为 root/哈希前两位/哈希，相同内容只保存一份，
+    不同用户的同名文件也不会互相覆盖。blobs 表记录每个文件的引用计数
+    （任务输入、文件记录、压缩结果缓存各算一个引用），归零时删除文件。
+    """
+
+    def __init__(self, root: str = "blobs"):
+        self.root = root
+        self.temp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def temp_path(self) -> str:
+        return os.path.join(self.temp_dir, uuid.uuid4().hex)
+
+    async def ingest(self, db, temp_path: str, digest: str, size: int) -> models.Blob:
+        """把写好的临时文件按内容存入并增加一个引用，已有相同内容时删除临时文件"""
+        # 先登记引用再放置文件：release 删除记录、移走文件后会重新查询记录，
+        # 记录又被创建时放回文件，两边交错执行（包括在不同进程中）时文件都不会丢失
+        while not await self.add_ref(db, digest):
+            try:
+                db.add(models.Blob(hash=digest, size=size, ref_count=1))
+                await db.commit()
+                break
+            except IntegrityError:
+                # 其他请求同时存入了相同内容
+                await db.rollback()
+
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return await db.get(models.Blob, digest)
+
+    async def add_ref(self, db, digest: str) -> bool:
+        result = await db.execute(
+            update(models.Blob)
+            .where(models.Blob.hash == digest)
+            .values(ref_count=models.Blob.ref_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        return result.rowcount > 0
+
+    async def release(self, db, digest: str):
+        """释放一个引用，计数归零时删除记录和文件"""
+        if not digest:
+            return
+        await db.execute(
+            update(models.Blob)
+            .where(models.Blob.hash == digest)
+            .values(ref_count=models.Blob.ref_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(
+            delete(models.Blob)
+            .where(models.Blob.hash == digest, models.Blob.ref_count <= 0)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if result.rowcount:
+            await self._remove_file(db, digest)
+
+    async def _remove_file(self, db, digest: str):
+        # 先把文件移到临时目录，再确认期间没有 ingest 重新登记相同内容，否则放回
+        path = self.path(digest)
+        removed = self.temp_path()
+        try:
+            os.replace(path, removed)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 删除blob失败: {str(e)}")
+            return
+
+        restored = await db.scalar(select(models.Blob.hash).where(models.Blob.hash == digest))
+        await db.commit()
+        try:
+            if restored:
+                os.replace(removed, path)
+            else:
+                os.remove(removed)
+        except OSError as e:
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 删除blob失败: {str(e)}")
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+
+blob_store = BlobStore(os.getenv("BLOB_DIR", "blobs"))
@@ -0,0 +1,32 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# 后端模块按文件名直接导入（import compression），测试时把 backend 目录加入搜索路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import models
+
+
+@pytest.fixture
+def run_db(tmp_path):
+    """在临时 sqlite 数据库上运行 async 函数 func(sessions)，sessions 是会话工厂"""
+    path = tmp_path / "test.db"
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(engine)
+    engine.dispose()
+
+    def run(func):
+        async def main():
+            async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+            try:
+                return await func(async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False))
+            finally:
+                await async_engine.dispose()
+        return asyncio.run(main())
+    return run
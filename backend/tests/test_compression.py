@@ -0,0 +1,180 @@
+"""压缩格式的往返、旧文件解码和损坏输入测试
+
+tests/data 下的旧文件由历史版本的压缩器对 sample.txt 压缩生成：
+  baseline          整个文件一种格式（LZ77令牌流、Huffman频率表、Combined两层文件）
+  container_tokens  分块容器，LZ77块仍是4字节令牌，压缩前整体CBC加密
+  container_cbc     分块容器，LZ77块为变长编码，压缩前整体CBC加密
+当前格式解码这些文件的结果必须与 sample.txt 一致。
+"""
+import asyncio
+import io
+import os
+import random
+import struct
+
+import pytest
+
+import compression
+from compression import (
+    BLOCK_HEADER, CONTAINER_HEADER, CONTAINER_MAGIC, CONTAINER_VERSION, ALGORITHM_IDS,
+    CombinedCompressor, HuffmanCompressor, LZ77Compressor, ZipCompressor
+)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+COMPRESSORS = {
+    "lz77": LZ77Compressor,
+    "huffman": HuffmanCompressor,
+    "combined": CombinedCompressor,
+}
+
+
+def _sample():
+    with open(os.path.join(DATA_DIR, "sample.txt"), "rb") as file:
+        return file.read()
+
+
+PAYLOAD_IDS = ["empty", "one", "run", "period", "random", "binary", "far", "sample"]
+
+
+def _payloads():
+    rng = random.Random(12)
+    return [
+        b"",
+        b"x",
+        b"a" * 1000,
+        b"abcabcabcabcabcabcx" * 50,
+        bytes(rng.getrandbits(8) for _ in range(5000)),
+        bytes(rng.choice(b"ab") for _ in range(20000)),
+        # 远距离重复：偏移需要多个字节的变长编码
+        bytes(rng.getrandbits(8) for _ in range(40000)) * 2,
+        _sample(),
+    ]
+
+
+def _roundtrip_file(compressor_class, data, tmp_path):
+    source = tmp_path / "source"
+    packed = tmp_path / "packed"
+    restored = tmp_path / "restored"
+    source.write_bytes(data)
+    asyncio.run(compressor_class().compress(str(source), str(packed)))
+    asyncio.run(compressor_class().decompress(str(packed), str(restored)))
+    return restored.read_bytes()
+
+
+@pytest.mark.parametrize("compressor_class", list(COMPRESSORS.values()) + [ZipCompressor])
+@pytest.mark.parametrize("data", [b"", b"x", b"ab" * 70000, _sample()], ids=["empty", "one", "repeat", "sample"])
+def test_file_roundtrip(compressor_class, data, tmp_path):
+    assert _roundtrip_file(compressor_class, data, tmp_path) == data
+
+
+@pytest.mark.parametrize("data", _payloads(), ids=PAYLOAD_IDS)
+def test_lz77_block_roundtrip(data):
+    lz77 = LZ77Compressor()
+    block = lz77.compress_block(data)
+    assert block[:3] == LZ77Compressor.MAGIC
+    assert lz77.decompress_block(block) == data
+    assert lz77.decompress_block(block, len(data)) == data
+
+
+@pytest.mark.parametrize("data", _payloads(), ids=PAYLOAD_IDS)
+def test_huffman_block_roundtrip(data):
+    huffman = HuffmanCompressor()
+    block = huffman.compress_block(data)
+    assert HuffmanCompressor().decompress_block(block, len(data)) == data
+
+
+@pytest.mark.parametrize("data", _payloads(), ids=PAYLOAD_IDS)
+def test_combined_block_roundtrip(data):
+    combined = CombinedCompressor()
+    block = combined.compress_block(data)
+    assert CombinedCompressor().decompress_block(block, len(data)) == data
+
+
+def test_lz77_legacy_tokens():
+    # (偏移, 长度, 字符) 令牌：x，然后复制1个字节并追加 y；最后一个令牌以 0xFF 开头，只有匹配
+    tokens = bytes([0, 0, 0, ord("x"), 0, 1, 1, ord("y"), 0xFF, 0, 2, 3])
+    assert LZ77Compressor().decompress_block(tokens) == b"xxyxyx"
+
+
+@pytest.mark.parametrize("era", ["baseline", "container_tokens", "container_cbc"])
+@pytest.mark.parametrize("name", list(COMPRESSORS))
+def test_legacy_files_decode(era, name, tmp_path):
+    restored = tmp_path / "restored"
+    source = os.path.join(DATA_DIR, era, f"{name}.compressed")
+    asyncio.run(COMPRESSORS[name]().decompress(source, str(restored)))
+    assert restored.read_bytes() == _sample()
+
+
+@pytest.mark.parametrize("data", [b"abcabcabcabcabcabcx" * 50, bytes(range(256)) * 8], ids=["repeat", "bytes"])
+def test_lz77_corrupt_block(data):
+    lz77 = LZ77Compressor()
+    block = lz77.compress_block(data)
+    with pytest.raises(ValueError):
+        lz77.decompress_block(block[:len(block) // 2], len(data))
+    with pytest.raises(ValueError):
+        lz77.decompress_block(block, len(data) + 1)
+    # 块头中的长度与实际内容不符
+    forged = block[:4] + struct.pack(">Q", len(data) + 10) + block[12:]
+    with pytest.raises(ValueError):
+        lz77.decompress_block(forged)
+
+
+@pytest.mark.parametrize("name", ["lz77", "huffman"])
+def test_legacy_file_rejects_forged_size(name, tmp_path):
+    # 旧文件整体解码时没有块头中的原始长度，数据段里声明的长度不能直接用来分配内存
+    if name == "lz77":
+        forged = LZ77Compressor.MAGIC + struct.pack(">BQ", LZ77Compressor.FORMAT_VERSION, 1 << 62) + b"\x10A"
+    else:
+        forged = bytearray(HuffmanCompressor().compress_block(b"a" * 10))
+        forged[4:12] = struct.pack(">Q", 1 << 62)
+    source = tmp_path / "forged"
+    source.write_bytes(bytes(forged))
+    with pytest.raises(ValueError):
+        asyncio.run(COMPRESSORS[name]().decompress(str(source), str(tmp_path / "restored")))
+
+
+def test_lz77_unknown_version():
+    block = bytearray(LZ77Compressor().compress_block(b"hello"))
+    block[3] = 99
+    with pytest.raises(ValueError):
+        LZ77Compressor().decompress_block(bytes(block))
+
+
+def test_huffman_symbol_count_checked():
+    block = bytearray(HuffmanCompressor().compress_block(b"a" * 10))
+    block[4:12] = struct.pack(">Q", 1 << 40)
+    with pytest.raises(ValueError):
+        HuffmanCompressor().decompress_block(bytes(block), 10)
+    with pytest.raises(ValueError):
+        HuffmanCompressor().decompress_block(bytes(block), max_size=100)
+
+
+def _container(name, chunk_size, raw_size, payload):
+    header = CONTAINER_HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, ALGORITHM_IDS[name], 0, chunk_size)
+    return header + BLOCK_HEADER.pack(raw_size, len(payload)) + payload
+
+
+@pytest.mark.parametrize("name", list(COMPRESSORS))
+def test_container_rejects_oversized_block(name):
+    raw = _container(name, 1 << 20, 0xFFFFFFFF, b"\0" * 16)
+    with pytest.raises(ValueError):
+        asyncio.run(COMPRESSORS[name]().decompress_stream(io.BytesIO(raw), io.BytesIO()))
+
+
+@pytest.mark.parametrize("chunk_size", [0, compression.MAX_CHUNK_SIZE + 1])
+def test_container_rejects_invalid_chunk_size(chunk_size):
+    raw = _container("lz77", chunk_size, 1, b"\0")
+    with pytest.raises(ValueError):
+        asyncio.run(LZ77Compressor().decompress_stream(io.BytesIO(raw), io.BytesIO()))
+
+
+@pytest.mark.parametrize("name", list(COMPRESSORS))
+def test_container_truncated(name, tmp_path):
+    source = tmp_path / "source"
+    packed = tmp_path / "packed"
+    source.write_bytes(_sample())
+    asyncio.run(COMPRESSORS[name]().compress(str(source), str(packed)))
+    truncated = tmp_path / "truncated"
+    truncated.write_bytes(packed.read_bytes()[:-20])
+    with pytest.raises(ValueError):
+        asyncio.run(COMPRESSORS[name]().decompress(str(truncated), str(tmp_path / "restored")))
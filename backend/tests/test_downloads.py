@@ -0,0 +1,140 @@
+"""下载接口的 Range / If-Range / multipart/byteranges / 条件请求测试"""
+import hashlib
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import downloads
+from downloads import file_response, parse_range, sends_content, starts_from_beginning
+
+DATA = bytes(range(256)) * 40
+SIZE = len(DATA)
+ETAG = f'"{hashlib.sha256(DATA).hexdigest()}"'
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-9", [(0, 9)]),
+    ("bytes=100-", [(100, SIZE - 1)]),
+    ("bytes=-10", [(SIZE - 10, SIZE - 1)]),
+    ("bytes=-100000", [(0, SIZE - 1)]),
+    ("bytes=0-99999", [(0, SIZE - 1)]),
+    # 重叠和相邻的区间按顺序合并
+    ("bytes=50-59, 0-9, 5-20, 21-30", [(0, 30), (50, 59)]),
+    ("bytes=100000-", []),
+    ("bytes=-0", []),
+    ("bytes=9-0", None),
+    ("bytes=a-b", None),
+    ("items=0-9", None),
+    ("bytes=" + ",".join(f"{i * 10}-{i * 10}" for i in range(downloads.MAX_RANGES + 1)), None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(DATA)
+    app = FastAPI()
+    sent = []
+
+    @app.get("/file")
+    async def get_file(request: Request):
+        response = await file_response(request, str(path), "data.bin")
+        sent.append((sends_content(response), starts_from_beginning(response)))
+        return response
+
+    with TestClient(app) as test_client:
+        test_client.sent = sent
+        yield test_client
+
+
+def test_full_download(client):
+    response = client.get("/file")
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["etag"] == ETAG
+    assert response.headers["accept-ranges"] == "bytes"
+    assert client.sent == [(True, True)]
+
+
+def test_suffix_range(client):
+    response = client.get("/file", headers={"Range": "bytes=-100"})
+    assert response.status_code == 206
+    assert response.content == DATA[-100:]
+    assert response.headers["content-range"] == f"bytes {SIZE - 100}-{SIZE - 1}/{SIZE}"
+    assert response.headers["content-length"] == "100"
+    # 续传的后续分段也发送内容，但不是从文件开头开始
+    assert client.sent == [(True, False)]
+
+
+def test_unsatisfiable_range(client):
+    response = client.get("/file", headers={"Range": f"bytes={SIZE}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{SIZE}"
+    assert response.content == b""
+    assert client.sent == [(False, False)]
+
+
+def test_if_range_matching_etag(client):
+    response = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": ETAG})
+    assert response.status_code == 206
+    assert response.content == DATA[:10]
+
+
+@pytest.mark.parametrize("if_range", ['"stale"', f"W/{ETAG}", "Thu, 01 Jan 1970 00:00:00 GMT"])
+def test_stale_if_range_returns_full_file(client, if_range):
+    # ETag 不一致（If-Range 不接受弱比较）或日期不一致时忽略 Range，返回整个文件
+    response = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": if_range})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+
+def test_multiple_ranges(client):
+    response = client.get("/file", headers={"Range": "bytes=0-9, 100-119, -5"})
+    assert response.status_code == 206
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1].encode()
+    assert int(response.headers["content-length"]) == len(response.content)
+
+    body = response.content
+    assert body.endswith(b"\r\n--" + boundary + b"--\r\n")
+    parts = body[:-len(boundary) - 8].split(b"\r\n--" + boundary + b"\r\n")[1:]
+    expected = [(0, 9), (100, 119), (SIZE - 5, SIZE - 1)]
+    assert len(parts) == len(expected)
+    for part, (start, end) in zip(parts, expected):
+        head, payload = part.split(b"\r\n\r\n", 1)
+        assert f"Content-Range: bytes {start}-{end}/{SIZE}".encode() in head
+        assert payload == DATA[start:end + 1]
+    assert client.sent == [(True, True)]
+
+
+def test_if_none_match_returns_304(client):
+    response = client.get("/file", headers={"If-None-Match": f'W/{ETAG}, "other"'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == ETAG
+    assert client.sent == [(False, False)]
+
+    response = client.get("/file", headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+
+def test_if_modified_since(client):
+    last_modified = client.get("/file").headers["last-modified"]
+    assert client.get("/file", headers={"If-Modified-Since": last_modified}).status_code == 304
+    response = client.get("/file", headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"})
+    assert response.status_code == 200
+
+
+def test_etag_recomputed_after_change(client, tmp_path):
+    assert client.get("/file").headers["etag"] == ETAG
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"changed")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert client.get("/file").headers["etag"] == f'"{hashlib.sha256(b"changed").hexdigest()}"'
@@ -0,0 +1,79 @@
+"""blob存储的引用计数和并发存入/释放测试"""
+import hashlib
+import os
+
+from sqlalchemy import select
+
+import models
+from storage import BlobStore
+
+DATA = b"blob contents"
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+def _temp_file(store, data=DATA):
+    temp_path = store.temp_path()
+    with open(temp_path, "wb") as file:
+        file.write(data)
+    return temp_path
+
+
+async def _ref_count(db, digest=DIGEST):
+    return await db.scalar(select(models.Blob.ref_count).where(models.Blob.hash == digest))
+
+
+def test_release_removes_file_with_last_reference(run_db, tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+
+    async def scenario(sessions):
+        async with sessions() as db:
+            await store.ingest(db, _temp_file(store), DIGEST, len(DATA))
+            await store.ingest(db, _temp_file(store), DIGEST, len(DATA))
+            assert await _ref_count(db) == 2
+            with open(store.path(DIGEST), "rb") as file:
+                assert file.read() == DATA
+
+            await store.release(db, DIGEST)
+            assert store.exists(DIGEST)
+            assert await _ref_count(db) == 1
+
+            await store.release(db, DIGEST)
+            assert not store.exists(DIGEST)
+            assert await _ref_count(db) is None
+        # 临时文件都已移走或删除
+        assert os.listdir(store.temp_dir) == []
+
+    run_db(scenario)
+
+
+def test_release_keeps_file_ingested_concurrently(run_db, tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path / "blobs"))
+    remove_file = store._remove_file
+
+    async def scenario(sessions):
+        async with sessions() as db, sessions() as other:
+            await store.ingest(db, _temp_file(store), DIGEST, len(DATA))
+
+            async def ingest_then_remove(session, digest):
+                # release 已删除记录、还没移走文件时，另一个请求存入相同内容
+                await store.ingest(other, _temp_file(store), DIGEST, len(DATA))
+                await remove_file(session, digest)
+
+            monkeypatch.setattr(store, "_remove_file", ingest_then_remove)
+            await store.release(db, DIGEST)
+
+            assert await _ref_count(other) == 1
+            assert store.exists(DIGEST)
+        assert os.listdir(store.temp_dir) == []
+
+    run_db(scenario)
+
+
+def test_release_without_digest_is_noop(run_db, tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+
+    async def scenario(sessions):
+        async with sessions() as db:
+            await store.release(db, None)
+
+    run_db(scenario)
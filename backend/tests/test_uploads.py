@@ -0,0 +1,204 @@
+"""分块上传会话的乱序、重复、越界分块以及提交和清理测试"""
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+import models
+import uploads
+from storage import BlobStore
+from uploads import UploadManager
+
+DATA = os.urandom(10000)
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+async def _stream(*parts):
+    for part in parts:
+        yield part
+
+
+async def _chunk_count(db, session_id):
+    return await db.scalar(
+        select(func.count()).select_from(models.UploadChunk).where(models.UploadChunk.session_id == session_id)
+    )
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "blob_store", BlobStore(str(tmp_path / "blobs")))
+    return UploadManager(str(tmp_path / "sessions"))
+
+
+async def _create(manager, db, size=len(DATA)):
+    return await manager.create(db, owner_id=1, kind="compress", algorithm="lz77", filename="data.bin",
+                                total_size=size)
+
+
+def test_out_of_order_chunks(run_db, manager):
+    async def scenario(sessions):
+        async with sessions() as db:
+            session = await _create(manager, db)
+            status = await manager.write_chunk(db, session, 6000, _stream(DATA[6000:8000], DATA[8000:]))
+            # 开头还没收到，连续偏移仍为0
+            assert status["offset"] == 0
+            assert status["received"] == [[6000, len(DATA)]]
+
+            status = await manager.write_chunk(db, session, 0, _stream(DATA[:3000]))
+            assert status["offset"] == 3000
+            status = await manager.write_chunk(db, session, 3000, _stream(DATA[3000:6000]))
+            assert status["offset"] == len(DATA)
+            assert status["received"] == [[0, len(DATA)]]
+
+            digest, size = await manager.finalize(db, session)
+            assert (digest, size) == (DIGEST, len(DATA))
+            with open(uploads.blob_store.path(digest), "rb") as file:
+                assert file.read() == DATA
+
+            await manager.complete(db, session, "task")
+            assert session.status == "completed"
+            assert not os.path.exists(session.staging_path)
+            assert await _chunk_count(db, session.id) == 0
+
+    run_db(scenario)
+
+
+def test_duplicate_and_overlapping_chunks(run_db, manager):
+    async def scenario(sessions):
+        async with sessions() as db:
+            session = await _create(manager, db)
+            await manager.write_chunk(db, session, 0, _stream(DATA[:4000]))
+            # 重传同一分块、与已有分块重叠的分块
+            await manager.write_chunk(db, session, 0, _stream(DATA[:4000]))
+            status = await manager.write_chunk(db, session, 2000, _stream(DATA[2000:7000]))
+            assert status["received"] == [[0, 7000]]
+            await manager.write_chunk(db, session, 7000, _stream(DATA[7000:]))
+
+            digest, _ = await manager.finalize(db, session)
+            assert digest == DIGEST
+
+    run_db(scenario)
+
+
+def test_chunk_outside_file_rejected(run_db, manager, monkeypatch):
+    async def scenario(sessions):
+        async with sessions() as db:
+            session = await _create(manager, db)
+            for offset, data in ((-1, b"x"), (len(DATA) + 1, b"x"), (len(DATA) - 10, DATA[:20])):
+                with pytest.raises(HTTPException) as error:
+                    await manager.write_chunk(db, session, offset, _stream(data))
+                assert error.value.status_code == 400
+
+            monkeypatch.setattr(uploads, "MAX_CHUNK_SIZE", 100)
+            with pytest.raises(HTTPException) as error:
+                await manager.write_chunk(db, session, 0, _stream(DATA[:101]))
+            assert error.value.status_code == 413
+            # 被拒绝的分块不记录区间
+            assert (await manager.status(db, session))["received"] == []
+
+    run_db(scenario)
+
+
+def test_finalize_incomplete_upload(run_db, manager):
+    async def scenario(sessions):
+        async with sessions() as db:
+            session = await _create(manager, db)
+            await manager.write_chunk(db, session, 0, _stream(DATA[:5000]))
+            await manager.write_chunk(db, session, 6000, _stream(DATA[6000:]))
+            with pytest.raises(HTTPException) as error:
+                await manager.finalize(db, session)
+            assert error.value.status_code == 409
+            assert session.status == "uploading"
+
+            # 补齐缺少的区间后可以提交
+            await manager.write_chunk(db, session, 5000, _stream(DATA[5000:6000]))
+            digest, size = await manager.finalize(db, session)
+            assert (digest, size) == (DIGEST, len(DATA))
+
+    run_db(scenario)
+
+
+def test_finalize_twice_and_reopen(run_db, manager):
+    async def scenario(sessions):
+        async with sessions() as db:
+            session = await _create(manager, db)
+            await manager.write_chunk(db, session, 0, _stream(DATA))
+            await manager.finalize(db, session)
+
+            with pytest.raises(HTTPException) as error:
+                await manager.finalize(db, session)
+            assert error.value.status_code == 409
+            with pytest.raises(HTTPException) as error:
+                await manager.write_chunk(db, session, 0, _stream(DATA[:10]))
+            assert error.value.status_code == 409
+
+            # 调用方释放引用并恢复会话后，客户端可以重新提交，暂存文件和分块仍在
+            await uploads.blob_store.release(db, DIGEST)
+            await manager.reopen(db, session)
+            assert os.path.exists(session.staging_path)
+            digest, _ = await manager.finalize(db, session)
+            assert digest == DIGEST
+            assert uploads.blob_store.exists(DIGEST)
+
+    run_db(scenario)
+
+
+def test_abort_removes_session(run_db, manager):
+    async def scenario(sessions):
+        async with sessions() as db:
+            session = await _create(manager, db)
+            await manager.write_chunk(db, session, 0, _stream(DATA[:100]))
+            await manager.abort(db, session)
+
+            assert not os.path.exists(session.staging_path)
+            assert await _chunk_count(db, session.id) == 0
+            with pytest.raises(HTTPException) as error:
+                await manager.get(db, session.id, owner_id=1)
+            assert error.value.status_code == 404
+
+    run_db(scenario)
+
+
+def test_abort_while_finalizing_rejected(run_db, manager):
+    async def scenario(sessions):
+        async with sessions() as db:
+            session = await _create(manager, db)
+            await manager.write_chunk(db, session, 0, _stream(DATA))
+            await manager.finalize(db, session)
+            with pytest.raises(HTTPException) as error:
+                await manager.abort(db, session)
+            assert error.value.status_code == 409
+            assert os.path.exists(session.staging_path)
+
+    run_db(scenario)
+
+
+def test_expired_sessions_cleaned_up(run_db, manager):
+    async def scenario(sessions):
+        async with sessions() as db:
+            expired = await _create(manager, db)
+            await manager.write_chunk(db, expired, 0, _stream(DATA[:100]))
+            expired.expires_at = datetime.utcnow() - timedelta(seconds=1)
+            await db.commit()
+
+            # 创建新会话时顺带清理过期会话
+            await _create(manager, db)
+            assert not os.path.exists(expired.staging_path)
+            assert await _chunk_count(db, expired.id) == 0
+            assert await db.scalar(select(func.count()).select_from(models.UploadSession)) == 1
+
+    run_db(scenario)
+
+
+def test_other_owner_cannot_access_session(run_db, manager):
+    async def scenario(sessions):
+        async with sessions() as db:
+            session = await _create(manager, db)
+            with pytest.raises(HTTPException) as error:
+                await manager.get(db, session.id, owner_id=2)
+            assert error.value.status_code == 404
+
+    run_db(scenario)
@@ -1,5 +1,8 @@
 import sqlite3
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
+
+import models
+from database import engine
 
 def add_encryption_key_column():
     print("正在更新数据库结构...")
@@ -50,8 +53,66 @@ def add_encryption_key_column():
             print(f"使用SQLAlchemy更新也失败: {str(e2)}")
             return False
 
+def create_missing_indexes(connection, table, names):
+    """按模型中的定义创建缺少的索引，生成的DDL与当前数据库方言一致"""
+    existing = {index["name"] for index in inspect(connection).get_indexes(table)}
+    for index in models.Base.metadata.tables[table].indexes:
+        if index.name in names and index.name not in existing:
+            print(f"创建索引 {index.name}...")
+            index.create(connection)
+
+def add_blob_columns():
+    """为内容寻址存储添加 source_hash / blob_hash 列，blobs 等新表由 create_all 创建"""
+    print("正在添加内容哈希列...")
+    new_columns = [
+        ("files", "source_hash", "VARCHAR(64)"),
+        ("files", "blob_hash", "VARCHAR(64) REFERENCES blobs(hash)"),
+        ("compression_jobs", "source_hash", "VARCHAR(64)"),
+    ]
+    try:
+        # 使用配置的数据库（DATABASE_URL），sqlite 和 mysql 都适用
+        with engine.begin() as connection:
+            tables = set(inspect(connection).get_table_names())
+            for table, column, column_type in new_columns:
+                if table not in tables:
+                    print(f"{table} 表不存在，跳过")
+                    continue
+                column_names = [column_info["name"] for column_info in inspect(connection).get_columns(table)]
+                if column not in column_names:
+                    print(f"添加 {column} 列到 {table} 表...")
+                    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+                else:
+                    print(f"{table}.{column} 列已存在，无需修改")
+
+            if "files" in tables:
+                create_missing_indexes(connection, "files", {"ix_files_source_hash"})
+        return True
+    except Exception as e:
+        print(f"添加内容哈希列失败: {str(e)}")
+        return False
+
+def add_listing_indexes():
+    """为文件列表、压缩历史的游标分页和分享列表的关联查询建立索引"""
+    print("正在创建列表索引...")
+    try:
+        with engine.begin() as connection:
+            create_missing_indexes(connection, "files", {"ix_files_owner_created"})
+            create_missing_indexes(connection, "file_shares", {"ix_file_shares_file_id"})
+            # 更新统计信息，让查询优化器使用新索引
+            if engine.dialect.name == "sqlite":
+                connection.execute(text("ANALYZE"))
+            elif engine.dialect.name == "mysql":
+                connection.execute(text("ANALYZE TABLE files, file_shares"))
+        print("索引创建成功！")
+        return True
+    except Exception as e:
+        print(f"创建索引失败: {str(e)}")
+        return False
+
 if __name__ == "__main__":
-    success = add_encryption_key_column()
+    # encryption_key 是早期 sqlite 数据库的迁移，其他数据库由 create_all 建表，不需要
+    success = engine.dialect.name != "sqlite" or add_encryption_key_column()
+    success = success and add_blob_columns() and add_listing_indexes()
     if success:
         print("数据库更新完成！")
     else:
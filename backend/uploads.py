@@ -0,0 +1,229 @@
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select, update
+from fastapi.concurrency import run_in_threadpool
+
+import models
+from storage import blob_store, hash_file
+
+# 单个分块的最大字节数，超过时拒绝并要求客户端拆小
+MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_MAX_CHUNK_SIZE", str(64 * 1024 * 1024)))
+# 上传会话的有效期，过期未完成的会话及其暂存文件会被清理
+SESSION_TTL = timedelta(hours=float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24")))
+
+
+class UploadManager:
+    """可续传的分块上传
+
+    创建会话时按总大小建立稀疏的暂存文件，每个分块按偏移直接写入，写完后在
+    upload_chunks 表记录一条区间；分块可以乱序、并行或重复上传。全部区间到齐
+    后由 finalize 计算哈希、存入blob存储，再由调用方提交压缩/解压任务。
+    """
+
+    def __init__(self, staging_dir: str = os.path.join("uploads", "sessions")):
+        self.staging_dir = staging_dir
+        os.makedirs(staging_dir, exist_ok=True)
+
+    async def create(self, db, owner_id: int, kind: str, algorithm: str, filename: str, total_size: int):
+        if total_size < 0:
+            raise HTTPException(status_code=400, detail="文件大小无效")
+        await self.cleanup_expired(db)
+
+        session_id = str(uuid.uuid4())
+        staging_path = os.path.join(self.staging_dir, f"{session_id}.part")
+        # 预先设置文件长度，未写入的部分不占用磁盘
+        await run_in_threadpool(self._allocate, staging_path, total_size)
+
+        session = models.UploadSession(
+            id=session_id,
+            owner_id=owner_id,
+            kind=kind,
+            algorithm=algorithm,
+            filename=filename,
+            total_size=total_size,
+            staging_path=staging_path,
+            expires_at=datetime.utcnow() + SESSION_TTL
+        )
+        db.add(session)
+        await db.commit()
+        return session
+
+    @staticmethod
+    def _allocate(staging_path: str, total_size: int):
+        with open(staging_path, "wb") as file:
+            file.truncate(total_size)
+
+    async def get(self, db, session_id: str, owner_id: int):
+        result = await db.execute(
+            select(models.UploadSession)
+            .where(models.UploadSession.id == session_id,
+                   models.UploadSession.owner_id == owner_id)
+        )
+        session = result.scalars().first()
+        if not session:
+            raise HTTPException(status_code=404, detail="上传会话不存在")
+        return session
+
+    async def received_ranges(self, db, session_id: str):
+        """已收到的区间，合并为 [start, end) 列表"""
+        result = await db.execute(
+            select(models.UploadChunk.offset, models.UploadChunk.length)
+            .where(models.UploadChunk.session_id == session_id)
+            .order_by(models.UploadChunk.offset)
+        )
+        chunks = result.all()
+        ranges = []
+        for offset, length in chunks:
+            end = offset + length
+            if ranges and offset <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([offset, end])
+        return ranges
+
+    async def status(self, db, session):
+        ranges = await self.received_ranges(db, session.id)
+        # offset 为从开头连续收到的字节数，顺序上传的客户端从这里继续
+        offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        return {
+            "uploadId": session.id,
+            "filename": session.filename,
+            "size": session.total_size,
+            "offset": offset,
+            "received": ranges,
+            "status": session.status,
+            "taskId": session.task_id
+        }
+
+    async def write_chunk(self, db, session, offset: int, stream):
+        """把请求体按偏移写入暂存文件，写完后记录区间"""
+        if session.status != "uploading":
+            raise HTTPException(status_code=409, detail="上传已完成")
+        if offset < 0 or offset > session.total_size:
+            raise HTTPException(status_code=400, detail="偏移量无效")
+
+        fd = await run_in_threadpool(os.open, session.staging_path, os.O_WRONLY)
+        written = 0
+        try:
+            async for data in stream:
+                if not data:
+                    continue
+                if written + len(data) > MAX_CHUNK_SIZE:
+                    raise HTTPException(status_code=413, detail="分块过大")
+                if offset + written + len(data) > session.total_size:
+                    raise HTTPException(status_code=400, detail="分块超出文件大小")
+                await run_in_threadpool(os.pwrite, fd, data, offset + written)
+                written += len(data)
+        finally:
+            await run_in_threadpool(os.close, fd)
+
+        if written:
+            db.add(models.UploadChunk(session_id=session.id, offset=offset, length=written))
+            await db.commit()
+        return await self.status(db, session)
+
+    async def finalize(self, db, session):
+        """检查所有区间都已收到，把暂存文件存入blob存储，返回 (哈希, 大小)
+
+        返回时已为调用方增加一个引用。暂存文件和区间记录保留到 complete，
+        调用方提交任务失败时释放引用并调用 reopen，客户端可以重新提交。
+        """
+        ranges = await self.received_ranges(db, session.id)
+        if session.total_size and ranges != [[0, session.total_size]]:
+            raise HTTPException(status_code=409, detail="文件尚未上传完整")
+
+        # 条件更新，避免同一会话被并发提交两次
+        result = await db.execute(
+            update(models.UploadSession)
+            .where(models.UploadSession.id == session.id,
+                   models.UploadSession.status == "uploading")
+            .values(status="finalizing")
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if not result.rowcount:
+            raise HTTPException(status_code=409, detail="上传已完成")
+        session.status = "finalizing"
+
+        try:
+            digest, size = await run_in_threadpool(hash_file, session.staging_path)
+            # 以硬链接存入，暂存文件保留到任务提交成功
+            temp_path = blob_store.temp_path()
+            await run_in_threadpool(self._link, session.staging_path, temp_path)
+            await blob_store.ingest(db, temp_path, digest, size)
+        except Exception:
+            await self.reopen(db, session)
+            raise
+        return digest, size
+
+    @staticmethod
+    def _link(source: str, target: str):
+        try:
+            os.link(source, target)
+        except OSError:
+            # 不在同一文件系统或不支持硬链接
+            shutil.copyfile(source, target)
+
+    async def reopen(self, db, session):
+        """提交失败后恢复为上传中，已收到的分块仍然有效"""
+        await db.rollback()
+        await db.execute(
+            update(models.UploadSession)
+            .where(models.UploadSession.id == session.id,
+                   models.UploadSession.status == "finalizing")
+            .values(status="uploading")
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        session.status = "uploading"
+
+    async def complete(self, db, session, task_id: str):
+        await db.execute(
+            delete(models.UploadChunk)
+            .where(models.UploadChunk.session_id == session.id)
+        )
+        session.status = "completed"
+        session.task_id = task_id
+        await db.commit()
+        try:
+            os.remove(session.staging_path)
+        except FileNotFoundError:
+            pass
+
+    async def abort(self, db, session):
+        if session.status == "finalizing":
+            raise HTTPException(status_code=409, detail="上传正在提交")
+        await self._remove(db, session)
+        await db.commit()
+
+    async def cleanup_expired(self, db):
+        result = await db.execute(
+            select(models.UploadSession)
+            .where(models.UploadSession.expires_at < datetime.utcnow())
+        )
+        expired = result.scalars().all()
+        for session in expired:
+            await self._remove(db, session)
+        if expired:
+            await db.commit()
+            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 清理过期上传会话: {len(expired)} 个")
+
+    async def _remove(self, db, session):
+        await db.execute(
+            delete(models.UploadChunk)
+            .where(models.UploadChunk.session_id == session.id)
+        )
+        await db.delete(session)
+        if session.status != "completed":
+            try:
+                os.remove(session.staging_path)
+            except FileNotFoundError:
+                pass
+
+
+upload_manager = UploadManager()
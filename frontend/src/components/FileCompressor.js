@@ -8,6 +8,7 @@ import { ALGORITHMS } from '../constants/algorithms';
 import { copyToClipboard } from '../utils/fileUtils';
 import { useAuth } from '../contexts/AuthContext';
 import axiosInstance from '../utils/axios';
+import { decompressFile } from '../utils/jobs';
 
 export const FileCompressor = () => {
   const { token } = useAuth();
@@ -61,8 +62,9 @@ export const FileCompressor = () => {
     try {
       // 先建立WebSocket连接
       const token = localStorage.getItem('token');
-      const taskId = crypto.randomUUID(); // 生成一个新的任务ID
+      const taskId = crypto.randomUUID(); // 生成一个新的任务ID，上传时作为服务端任务ID
       setCompressionTaskId(taskId);
+      formData.append('task_id', taskId);
       
       console.log('准备建立WebSocket连接...');
       const ws = new WebSocket(`ws://localhost:8000/ws/compression?token=Bearer ${token}&task_id=${taskId}`);
@@ -262,25 +264,16 @@ export const FileCompressor = () => {
   const handleFileDecompress = async (file) => {
     try {
       message.loading('正在解压文件...', 0);
-      
-      // 创建FormData对象
-      const formData = new FormData();
-      formData.append('file', file);
-      formData.append('algorithm', algorithm);
-
-      // 发送解压请求
-      const response = await axiosInstance.post('/decompress', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data'
-        }
-      });
+
+      // 提交解压任务并等待后台任务完成
+      const filename = await decompressFile(file, algorithm);
 
       message.destroy(); // 销毁加载消息
       message.success('文件解压成功');
       
       // 自动下载解压后的文件
-      if (response.data && response.data.filename) {
-        await handleDownload(response.data.filename);
+      if (filename) {
+        await handleDownload(filename);
       } else {
         message.warning('无法自动下载解压后的文件');
       }
@@ -4,6 +4,7 @@ import { FileList } from '../components/FileList';
 import { ShareModal } from '../components/ShareModal';
 import axiosInstance from '../utils/axios';
 import { copyToClipboard } from '../utils/fileUtils';
+import { decompressFile } from '../utils/jobs';
 
 const { Title } = Typography;
 
@@ -79,8 +80,6 @@ export const FilesPage = () => {
 
   const handleDecompress = async (file) => {
     try {
-      // 创建FormData对象
-      const formData = new FormData();
       // 获取压缩文件
       const response = await axiosInstance.get(`/download/${file.compressedName}`, {
         responseType: 'blob'
@@ -90,21 +89,13 @@ export const FilesPage = () => {
       const compressedFile = new File([response.data], file.compressedName, {
         type: 'application/octet-stream'
       });
-      
-      // 添加到FormData
-      formData.append('file', compressedFile);
-      formData.append('algorithm', file.algorithm);
 
-      // 发送解压请求
-      const decompressResponse = await axiosInstance.post('/decompress', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data'
-        }
-      });
+      // 提交解压任务并等待后台任务完成
+      const filename = await decompressFile(compressedFile, file.algorithm);
 
       message.success('文件解压成功');
       // 自动下载解压后的文件
-      handleDownload(decompressResponse.data.filename);
+      handleDownload(filename);
     } catch (error) {
       message.error('文件解压失败: ' + (error.response?.data?.detail || error.message));
     }
@@ -0,0 +1,38 @@
+import axiosInstance from './axios';
+
+const POLL_INTERVAL = 500;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// 轮询任务状态直到结束；任务失败或被取消时抛出错误
+export const waitForJob = async (taskId) => {
+  for (;;) {
+    const response = await axiosInstance.get(`/jobs/${taskId}`);
+    const job = response.data;
+    if (job.status === 'completed') {
+      return job;
+    }
+    if (job.status === 'failed' || job.status === 'cancelled') {
+      throw new Error(job.error || (job.status === 'cancelled' ? '任务已取消' : '任务失败'));
+    }
+    await sleep(POLL_INTERVAL);
+  }
+};
+
+// 提交解压任务并等待完成，返回解压后的文件名
+// 解压在后台任务中执行，/decompress 返回时文件还没有生成，必须等任务完成后再下载
+export const decompressFile = async (file, algorithm) => {
+  const taskId = crypto.randomUUID();
+  const formData = new FormData();
+  formData.append('file', file);
+  formData.append('algorithm', algorithm);
+  formData.append('task_id', taskId);
+
+  const response = await axiosInstance.post('/decompress', formData, {
+    headers: {
+      'Content-Type': 'multipart/form-data'
+    }
+  });
+  await waitForJob(response.data.taskId || taskId);
+  return response.data.filename;
+};